@@ -0,0 +1,147 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class ApiCache:
+    """基于SQLite的API响应缓存，按接口和参数缓存，每个接口有独立的过期时间"""
+
+    # 各接口的缓存时间（秒），未列出的接口不缓存
+    DEFAULT_TTLS = {
+        # 视频元数据基本不变
+        '/x/web-interface/view': 7 * 24 * 3600,
+        # 下载链接带签名，会过期
+        '/x/player/playurl': 20 * 60,
+        # 收藏夹信息中的视频数量会变化
+        '/x/v3/fav/folder/info': 5 * 60,
+    }
+
+    def __init__(self, db_path, ttls=None, max_entries=50000):
+        self.db_path = str(db_path)
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self._inserts = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS api_cache (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                data TEXT NOT NULL,
+                expires REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_api_cache_access ON api_cache (last_access)')
+        self.conn.commit()
+
+    def make_key(self, endpoint, params):
+        """由接口路径和参数生成缓存键"""
+        return endpoint + '?' + json.dumps(params or {}, sort_keys=True, ensure_ascii=False)
+
+    def is_cacheable(self, endpoint):
+        """接口是否启用缓存"""
+        return self.ttls.get(endpoint, 0) > 0
+
+    def get(self, endpoint, params):
+        """读取缓存，未命中或已过期时返回None"""
+        if not self.is_cacheable(endpoint):
+            return None
+
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute('SELECT data, expires FROM api_cache WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return None
+
+            self.conn.execute('UPDATE api_cache SET last_access = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, endpoint, params, data):
+        """写入缓存"""
+        if not self.is_cacheable(endpoint):
+            return
+
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO api_cache (key, endpoint, data, expires, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, endpoint, json.dumps(data, ensure_ascii=False), now + self.ttls[endpoint], now)
+            )
+            self._inserts += 1
+            # 每写入一批检查一次容量
+            if self._inserts % 100 == 0:
+                self._evict(now)
+            self.conn.commit()
+
+    def invalidate(self, endpoint, params):
+        """删除某个缓存项"""
+        with self._lock:
+            self.conn.execute('DELETE FROM api_cache WHERE key = ?', (self.make_key(endpoint, params),))
+            self.conn.commit()
+
+    def _evict(self, now):
+        """清理过期项，超出容量时按最近访问时间淘汰"""
+        self.conn.execute('DELETE FROM api_cache WHERE expires < ?', (now,))
+        count = self.conn.execute('SELECT COUNT(*) FROM api_cache').fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                'DELETE FROM api_cache WHERE key IN (SELECT key FROM api_cache ORDER BY last_access LIMIT ?)',
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self.conn.execute('DELETE FROM api_cache')
+            self.conn.commit()
+
+    def stats(self):
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class NullCache:
+    """不缓存任何内容，用于关闭缓存"""
+
+    hits = 0
+    misses = 0
+
+    def get(self, endpoint, params):
+        return None
+
+    def set(self, endpoint, params, data):
+        pass
+
+    def invalidate(self, endpoint, params):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'hits': 0, 'misses': 0, 'hit_rate': 0.0}
+
+    def close(self):
+        pass
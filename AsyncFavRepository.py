@@ -0,0 +1,776 @@
+import aiohttp
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+from FavRepository import FavRepository
+from PullPlan import PullPlan
+from SyncMetrics import SyncMetrics
+
+class AsyncFavRepository(FavRepository):
+    """基于asyncio的同步引擎，与FavRepository共用仓库格式、缓存和索引，两种引擎可同步同一个仓库"""
+
+    def __init__(self, base_dir=None, api_concurrency=4, transfer_concurrency=4, **kwargs):
+        # API请求和文件传输分别限制并发数，传输并发数即max_transfers
+        self.api_concurrency = api_concurrency
+        super().__init__(base_dir, max_transfers=transfer_concurrency, **kwargs)
+        self.api_http = None
+        self.http = None
+
+    def set_max_transfers(self, max_transfers):
+        super().set_max_transfers(max_transfers)
+        self.transfer_concurrency = self.max_transfers
+
+    async def open_session(self):
+        """创建异步会话和并发限制，需在事件循环中调用
+
+        API和CDN使用两个会话，连接池互不影响；超时和保持连接的设置与同步引擎的HttpTransport相同
+        """
+        transport = self.session
+        timeout = aiohttp.ClientTimeout(sock_connect=transport.connect_timeout, sock_read=transport.read_timeout)
+        force_close = not transport.keep_alive
+        api_connector = aiohttp.TCPConnector(limit=self.api_concurrency * 2, force_close=force_close)
+        self.api_http = aiohttp.ClientSession(headers=self.headers, connector=api_connector, timeout=timeout)
+        connector = aiohttp.TCPConnector(limit=self.transfer_concurrency * self.segments * 2, force_close=force_close)
+        self.http = aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=timeout)
+        self._api_semaphore = asyncio.Semaphore(self.api_concurrency)
+        self._transfer_semaphore = asyncio.Semaphore(self.transfer_concurrency)
+        # 正在写入共享存储的对象 {对象名: asyncio.Lock}
+        self._async_object_locks = {}
+        # ffmpeg后处理使用独立的线程池；同时持有临时文件的视频数有上限，合并跟不上时暂停新的传输
+        self._post_executor = ThreadPoolExecutor(max_workers=self.post_workers)
+        self._pending_post = asyncio.Semaphore(self.transfer_concurrency + self.post_workers)
+
+    async def close_session(self):
+        if self.http is not None:
+            await self.api_http.close()
+            await self.http.close()
+            self.http = None
+            self._post_executor.shutdown(wait=False)
+
+    async def run_blocking(self, func, *args):
+        """在默认线程池中运行会阻塞的文件或数据库操作，不占用事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(None, SyncMetrics.bind(func), *args)
+
+    async def api_get_async(self, url, params):
+        """请求API并返回JSON数据，与api_get共用缓存和限速器"""
+        endpoint = urlparse(url).path
+        metrics = SyncMetrics.current()
+        data = self.cache.get(endpoint, params)
+        if data is not None:
+            metrics.api_cache_hit(endpoint)
+            return data
+
+        for attempt in range(self.api_max_retries + 1):
+            async with self._api_semaphore:
+                await asyncio.sleep(self.api_limiter.reserve())
+                start = time.time()
+                try:
+                    data = self.parse_api_response(*await self.fetch_text_async(url, params))
+                except Exception:
+                    metrics.api_error(endpoint)
+                    raise
+                finally:
+                    metrics.api_request(endpoint, time.time() - start, retry=attempt > 0)
+            if not self.is_throttled(data):
+                break
+
+            metrics.api_throttled(endpoint)
+            self.api_limiter.on_throttle()
+            if attempt < self.api_max_retries:
+                delay = self.api_limiter.backoff_delay(attempt)
+                print(f"请求被B站风控限制 (code {data['code']})，{delay:.1f} 秒后重试...")
+                await asyncio.sleep(delay)
+
+        if data.get('code') == 0:
+            self.api_limiter.on_success()
+            self.cache.set(endpoint, params, data)
+        else:
+            metrics.api_error(endpoint)
+        return data
+
+    async def fetch_text_async(self, url, params):
+        """API的GET请求，返回(状态码, 响应文本)；连接错误、超时和5xx响应按HttpTransport的设置重试"""
+        transport = self.session
+        for retry in range(transport.retries + 1):
+            last = retry == transport.retries
+            try:
+                async with self.api_http.get(url, params=params) as response:
+                    if last or response.status not in transport.RETRY_STATUS:
+                        return response.status, await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if last:
+                    raise
+            await asyncio.sleep(transport.backoff_delay(retry))
+
+    async def fetch_favorite_page_async(self, fid, page):
+        """获取收藏夹的一页内容，返回(medias, has_more)，出错时返回None"""
+        url = f"{self.api_base}/x/v3/fav/resource/list"
+        params = {
+            'media_id': fid,
+            'pn': page,
+            'ps': self.fav_page_size,
+            'keyword': '',
+            'order': 'mtime',
+            'type': 0,
+            'tid': 0,
+            'platform': 'web'
+        }
+
+        try:
+            data = await self.api_get_async(url, params)
+
+            if data['code'] != 0:
+                print(f"获取收藏夹失败: {data.get('message', '未知错误')}")
+                if data['code'] == -403:
+                    print("收藏夹可能是私密的或需要登录访问")
+                return None
+
+            return data['data']['medias'] or [], data['data'].get('has_more', False)
+        except Exception as e:
+            print(f"获取收藏夹出错: {e}")
+            return None
+
+    async def get_favorite_info_async(self, fid):
+        """获取收藏夹基本信息"""
+        url = f"{self.api_base}/x/v3/fav/folder/info"
+        try:
+            data = await self.api_get_async(url, {'media_id': fid})
+            if data['code'] != 0:
+                return None
+
+            info = data['data']
+            return {
+                'id': info['id'],
+                'title': self.clean_filename(info['title']),
+                'media_count': info['media_count'],
+                'upper': info['upper']['name'] if info['upper'] else 'Unknown'
+            }
+        except Exception as e:
+            print(f"获取收藏夹信息失败: {e}")
+            return None
+
+    async def get_favorite_videos_async(self, fid, media_count=None):
+        """获取收藏夹中的视频列表，各页并发获取，结果按页序合并去重"""
+        return [video async for video in self.iter_favorite_videos_async(fid, media_count)]
+
+    async def iter_favorite_videos_async(self, fid, media_count=None, status=None):
+        """iter_favorite_videos的异步版本，已知视频总数时最多提前获取api_concurrency页"""
+        status = {} if status is None else status
+        status['complete'] = False
+        if media_count is None:
+            fav_info = await self.get_favorite_info_async(fid)
+            media_count = fav_info['media_count'] if fav_info else 0
+
+        page_count = -(-media_count // self.fav_page_size)
+        prefetch = max(1, self.api_concurrency)
+        seen = set()
+        page = 1
+        next_page = 1
+        tasks = {}
+        has_more = page_count == 0
+        try:
+            while page <= page_count or has_more:
+                while next_page <= page_count and next_page < page + prefetch:
+                    tasks[next_page] = asyncio.ensure_future(self.fetch_favorite_page_async(fid, next_page))
+                    next_page += 1
+
+                if page in tasks:
+                    result = await tasks.pop(page)
+                else:
+                    # 获取期间收藏夹有新增，继续逐页获取剩余内容
+                    result = await self.fetch_favorite_page_async(fid, page)
+                if result is None:
+                    return
+
+                medias, has_more = result
+                if not medias:
+                    break
+
+                for media in medias:
+                    if media['type'] == 2 and media['bvid'] not in seen:  # 视频类型
+                        seen.add(media['bvid'])
+                        yield self.make_video_entry(media)
+                page += 1
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        print(f"已获取 {page - 1} 页")
+        status['complete'] = True
+
+    async def get_new_favorite_videos_async(self, fid, video_list):
+        """增量获取新增视频，返回(新增视频列表, 是否已获取完整列表)，出错时返回None"""
+        videos = []
+        seen = set()
+        page = 1
+
+        while True:
+            result = await self.fetch_favorite_page_async(fid, page)
+            if result is None:
+                return None
+
+            medias, has_more = result
+            for media in medias:
+                if media['type'] != 2 or media['bvid'] in seen:  # 只处理视频类型
+                    continue
+
+                known = video_list.get(media['bvid'])
+                if known and known.get('fav_time') is not None and known.get('fav_time') == media.get('fav_time'):
+                    print(f"已获取第 {page} 页，遇到已同步的视频，停止翻页")
+                    return videos, False
+
+                seen.add(media['bvid'])
+                videos.append(self.make_video_entry(media))
+
+            print(f"已获取第 {page} 页，共 {len(medias)} 个视频")
+            if not medias or not has_more:
+                return videos, True
+            page += 1
+
+    async def get_video_info_async(self, bvid):
+        """获取视频详细信息"""
+        url = f"{self.api_base}/x/web-interface/view"
+        try:
+            data = await self.api_get_async(url, {'bvid': bvid})
+            if data['code'] != 0:
+                return None
+            return data['data']
+        except Exception as e:
+            print(f"获取视频信息失败: {e}")
+            return None
+
+    async def get_video_download_url_async(self, bvid, cid, quality=80):
+        """获取视频下载链接"""
+        url = f"{self.api_base}/x/player/playurl"
+        try:
+            data = await self.api_get_async(url, self.playurl_params(bvid, cid, quality))
+            if data['code'] != 0:
+                return None, None
+            return self.parse_play_info(data['data'])
+        except Exception as e:
+            print(f"获取下载链接失败: {e}")
+            return None, None
+
+    async def probe_range_support_async(self, url):
+        """探测服务器是否支持Range请求，支持时返回文件总大小，否则返回None"""
+        try:
+            async with self.http.get(url, headers={'Range': 'bytes=0-0'}) as response:
+                return self.content_range_total(response.status, response.headers)
+        except Exception:
+            return None
+
+    async def probe_mirror_async(self, url):
+        """probe_mirror的异步版本"""
+        start = time.time()
+        try:
+            async with self.http.get(url, headers={'Range': f'bytes=0-{self.mirrors.probe_size - 1}'}) as response:
+                ttfb = time.time() - start
+                total = self.content_range_total(response.status, response.headers)
+                if total is not None:
+                    nbytes = len(await response.read())
+        except Exception:
+            total = None
+
+        if total is None:
+            self.mirrors.record_probe(url, None)
+        else:
+            self.mirrors.record_probe(url, ttfb, nbytes, time.time() - start - ttfb)
+        return total
+
+    async def select_mirrors_async(self, urls):
+        """select_mirrors的异步版本：并行探测尚未测速的镜像主机，返回(排序后的链接, 文件总大小)"""
+        sizes = {}
+        pending = self.mirrors.unprobed(urls) if len(urls) > 1 else []
+
+        async def probe(url):
+            sizes[url] = await self.probe_mirror_async(url)
+
+        await asyncio.gather(*[probe(url) for url in pending])
+
+        urls = self.mirrors.rank(urls)
+        for url in urls:
+            if url not in sizes:
+                sizes[url] = await self.probe_range_support_async(url)
+            if sizes[url] is not None:
+                return [url] + [other for other in urls if other != url], sizes[url]
+        return urls, None
+
+    async def download_file_async(self, url, filepath):
+        """下载文件，与download_file使用相同的.part续传格式，url可以是镜像链接列表"""
+        filepath = Path(filepath)
+        part_path = filepath.with_name(filepath.name + '.part')
+        state_path = filepath.with_name(filepath.name + '.part.json')
+
+        try:
+            async with self._transfer_semaphore:
+                urls, total_size = await self.select_mirrors_async(self.mirrors.candidates(url))
+                if total_size is None:
+                    return await self.download_file_stream_async(urls[0], filepath, part_path)
+
+                # 上次已完整下载
+                if filepath.exists() and not part_path.exists() and filepath.stat().st_size == total_size:
+                    return True
+
+                done = self.load_part_state(state_path, part_path, total_size)
+                if not done:
+                    # 预分配文件
+                    with open(part_path, 'wb') as f:
+                        f.truncate(total_size)
+
+                if not await self.download_file_ranges_async(urls, part_path, state_path, total_size, done):
+                    return False
+
+            os.replace(part_path, filepath)
+            if state_path.exists():
+                os.remove(state_path)
+            return True
+        except Exception as e:
+            print(f"下载失败: {e}")
+            return False
+
+    async def download_file_stream_async(self, url, filepath, part_path):
+        """单连接流式下载，用于不支持Range的服务器"""
+        start = time.time()
+        downloaded = 0
+        progress_id = None
+        try:
+            async with self.http.get(url) as response:
+                response.raise_for_status()
+                progress_id = self.progress.start(filepath.name, response.content_length or 0)
+                with open(part_path, 'wb') as f:
+                    async for chunk in self.iter_response_async(response):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        if progress_id is not None:
+                            self.progress.update(progress_id, len(chunk))
+        except Exception:
+            # 无法续传，丢弃不完整的文件
+            if part_path.exists():
+                os.remove(part_path)
+            raise
+        finally:
+            if progress_id is not None:
+                self.progress.finish(progress_id)
+            self.record_transfer(url, downloaded, time.time() - start)
+
+        os.replace(part_path, filepath)
+        return True
+
+    async def iter_response_async(self, response):
+        """iter_response的异步版本：StreamReader.read(size)只在缓冲区为空时等待，返回已到达的最多size字节"""
+        size = self.min_read_size
+        while True:
+            began = time.time()
+            chunk = await response.content.read(size)
+            if not chunk:
+                return
+            elapsed = time.time() - began
+            if len(chunk) == size and elapsed < 0.05:
+                size = min(size * 2, self.max_read_size)
+            elif elapsed > 0.5:
+                size = max(size // 2, self.min_read_size)
+            yield chunk
+
+    async def download_file_ranges_async(self, urls, part_path, state_path, total_size, done):
+        """并发下载缺失的字节区间，每段写入文件的对应偏移；某段出错或明显变慢时剩余部分改从其他镜像下载"""
+        urls = self.mirrors.candidates(urls)
+        tasks = []
+        for start, end in self.missing_ranges(total_size, done):
+            tasks.extend(self.split_ranges(start, end))
+
+        done = list(done)
+        last_save = [time.time()]
+        # 续传记录在线程池中写入，同一时间只写一次
+        save_lock = asyncio.Lock()
+        progress_id = self.progress.start(part_path.name[:-len('.part')], total_size,
+                                          sum(end - start + 1 for start, end in done))
+
+        async def save_state():
+            async with save_lock:
+                await self.run_blocking(self.save_part_state, state_path, total_size, list(done))
+
+        async def mark_done(start, end):
+            if progress_id is not None:
+                self.progress.update(progress_id, end - start + 1)
+            done.append((start, end))
+            done[:] = self.merge_ranges(done)
+            # 定期保存续传记录，上一次保存还未完成时跳过
+            if time.time() - last_save[0] >= 1 and not save_lock.locked():
+                last_save[0] = time.time()
+                await save_state()
+
+        def write_chunk(f, chunk):
+            # 与同步引擎相同：flush后才记为完成
+            f.write(chunk)
+            f.flush()
+
+        async def fetch_from(url, pos, end, alternatives):
+            """从一个镜像下载[pos, end]，返回(新位置, 状态, 错误)，状态为done、slow或error"""
+            began = time.time()
+            start = pos
+            try:
+                async with self.http.get(url, headers={'Range': f'bytes={pos}-{end}'}) as response:
+                    if response.status != 206:
+                        raise IOError(f"服务器未返回分段内容 (HTTP {response.status})")
+
+                    window_start, window_bytes = time.time(), 0
+                    with open(part_path, 'r+b') as f:
+                        f.seek(pos)
+                        async for chunk in self.iter_response_async(response):
+                            await self.run_blocking(write_chunk, f, chunk)
+                            await mark_done(pos, pos + len(chunk) - 1)
+                            pos += len(chunk)
+
+                            window_bytes += len(chunk)
+                            elapsed = time.time() - window_start
+                            if elapsed >= self.mirrors.window:
+                                if self.mirrors.should_switch(url, window_bytes / elapsed, alternatives):
+                                    return pos, 'slow', None
+                                window_start, window_bytes = time.time(), 0
+
+                if pos != end + 1:
+                    raise IOError(f"分段 {start}-{end} 不完整")
+                return pos, 'done', None
+            except asyncio.CancelledError:
+                # 其他分段失败时被取消（Python 3.7中CancelledError是Exception的子类）
+                raise
+            except Exception as e:
+                return pos, 'error', e
+            finally:
+                self.record_transfer(url, pos - start, time.time() - began)
+
+        async def fetch(start, end):
+            pos = start
+            tried = []
+            url = urls[0]
+            retries = 0
+            error_pos = start
+            while True:
+                tried.append(url)
+                alternatives = [other for other in self.mirrors.rank(urls) if other not in tried]
+                pos, status, error = await fetch_from(url, pos, end, alternatives)
+                if status == 'done':
+                    return
+                if status == 'error':
+                    self.mirrors.record_failure(url)
+                    if pos > error_pos:
+                        retries = 0
+                    error_pos = pos
+                    if not alternatives:
+                        if retries >= self.session.retries:
+                            raise error
+                        await asyncio.sleep(self.session.backoff_delay(retries))
+                        retries += 1
+                        continue
+                url = alternatives[0]
+
+        # 某段最终失败时取消其余分段，已完成的部分保留在续传记录中
+        futures = [asyncio.ensure_future(fetch(start, end)) for start, end in tasks]
+        error = None
+        try:
+            for future in asyncio.as_completed(futures):
+                try:
+                    await future
+                except Exception as e:
+                    error = e
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+            await asyncio.gather(*futures, return_exceptions=True)
+            if progress_id is not None:
+                self.progress.finish(progress_id)
+            await save_state()
+
+        if error is not None:
+            print(f"下载失败: {error}")
+            return False
+        return self.missing_ranges(total_size, done) == []
+
+    async def download_streams_async(self, jobs):
+        """并行下载多个流[(url, 文件路径), ...]，任一失败则取消其余下载"""
+        tasks = [asyncio.ensure_future(self.download_file_async(url, filepath)) for url, filepath in jobs]
+        try:
+            for future in asyncio.as_completed(tasks):
+                if not await future:
+                    return False
+            return True
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def download_video_async(self, video_info, repo_path, quality=80, audio_only=True):
+        """下载单个视频"""
+        bvid = video_info['bvid']
+        title = video_info['title']
+
+        if self.media_store:
+            key = self.media_store.object_key(bvid, quality, audio_only)
+            async with self._async_object_locks.setdefault(key, asyncio.Lock()):
+                if await self.run_blocking(self.link_stored_media, key, title, repo_path, audio_only):
+                    return True
+                if not await self._download_video_async(video_info, self.media_store.root, key, quality, audio_only):
+                    return False
+                return await self.run_blocking(self.link_stored_media, key, title, repo_path, audio_only)
+
+        return await self._download_video_async(video_info, repo_path, title, quality, audio_only)
+
+    async def _download_video_async(self, video_info, target_dir, file_name, quality, audio_only):
+        """获取下载链接并下载到target_dir/file_name"""
+        bvid = video_info['bvid']
+        title = video_info['title']
+
+        # 收藏夹列表已提供第一个分P的cid时无需再请求视频详细信息
+        cid = video_info.get('cid')
+        if not cid:
+            detail = await self.get_video_info_async(bvid)
+            if not detail:
+                print(f"获取视频详细信息失败: {title}")
+                return False
+            cid = detail['pages'][0]['cid']
+
+        urls, actual_quality = await self.get_video_download_url_async(bvid, cid, quality)
+        if not urls:
+            print(f"获取下载链接失败: {title}")
+            return False
+
+        if await self.download_from_urls_async(urls, file_name, target_dir, audio_only):
+            return True
+
+        # 缓存的下载链接可能已失效，下次重新获取
+        self.cache.invalidate('/x/player/playurl', self.playurl_params(bvid, cid, quality))
+        return False
+
+    async def stream_to_ffmpeg_async(self, urls, output_args, output_path):
+        """边下载边送入ffmpeg，阻塞的管道写入在线程池中进行，占用一个异步传输名额"""
+        loop = asyncio.get_running_loop()
+        async with self._transfer_semaphore:
+            return await loop.run_in_executor(None, SyncMetrics.bind(self._stream_to_ffmpeg), urls, output_args, output_path)
+
+    async def download_from_urls_async(self, urls, title, repo_path, audio_only=True):
+        """根据下载链接下载并生成最终文件，ffmpeg在独立的后处理线程池中运行"""
+        async with self._pending_post:
+            return await self._download_from_urls_async(urls, title, repo_path, audio_only)
+
+    async def _download_from_urls_async(self, urls, title, repo_path, audio_only):
+        loop = asyncio.get_running_loop()
+
+        if audio_only:
+            audio_file = repo_path / f"{title}.m4a"
+            if urls['audio']:
+                return await self.download_file_async(urls['audio'], audio_file)
+
+            # 如果没有单独音频流，下载视频后提取音频
+            if self.can_stream_ffmpeg():
+                if await self.stream_to_ffmpeg_async([urls['video']], ['-vn', '-acodec', 'copy'], audio_file):
+                    return True
+                print(f"流式提取失败，改为下载完整视频后提取: {title}")
+
+            video_file = repo_path / f"{title}_temp.mp4"
+            if not await self.download_file_async(urls['video'], video_file):
+                return False
+            ok = await loop.run_in_executor(self._post_executor, SyncMetrics.bind(self.extract_audio), video_file, audio_file)
+            os.remove(video_file)
+            return ok
+
+        final_file = repo_path / f"{title}.mp4"
+        if urls['audio'] and urls['video']:
+            # DASH格式，同时下载视频流和音频流后合并
+            if self.can_stream_ffmpeg():
+                if await self.stream_to_ffmpeg_async([urls['video'], urls['audio']], ['-c', 'copy'], final_file):
+                    return True
+                print(f"流式合并失败，改为分别下载后合并: {title}")
+
+            video_temp = repo_path / f"{title}_video.mp4"
+            audio_temp = repo_path / f"{title}_audio.m4a"
+            if not await self.download_streams_async([(urls['video'], video_temp), (urls['audio'], audio_temp)]):
+                return False
+
+            ok = await loop.run_in_executor(self._post_executor, SyncMetrics.bind(self.merge_video_audio), video_temp, audio_temp, final_file)
+            os.remove(video_temp)
+            os.remove(audio_temp)
+            return ok
+
+        # 传统格式，直接下载
+        return await self.download_file_async(urls['video'], final_file)
+
+    async def download_videos_async(self, videos, repo_name, config, journal=None):
+        """并发下载视频（列表或边获取边产出的异步迭代器），每个视频完成后立即提交，返回成功数量"""
+        repo_path = self.get_repo_path(repo_name)
+        counts = {'total': 0, 'finished': 0, 'downloaded': 0, 'listed': False}
+        # 同时处理中的视频数有上限，等待时暂停读取列表
+        slots = asyncio.Semaphore(self.transfer_concurrency * 2)
+
+        async def worker(video):
+            metrics = SyncMetrics.current()
+            try:
+                try:
+                    with metrics.item(video['bvid']), metrics.stage('download'):
+                        ok = await self.download_video_async(video, repo_path, config['quality'], config['audio_only'])
+                except Exception as e:
+                    print(f"下载出错 {video['title']}: {e}")
+                    ok = False
+
+                metrics.item_result(video['bvid'], ok)
+                if ok:
+                    await self.run_blocking(self.record_video, repo_name, config, video)
+                    counts['downloaded'] += 1
+                if journal is not None:
+                    await self.run_blocking(journal.mark, video['bvid'], 'done' if ok else 'failed')
+                counts['finished'] += 1
+                # 列表还在获取中时总数后加+
+                total = f"{counts['total']}" if counts['listed'] else f"{counts['total']}+"
+                mark = '✓' if ok else '✗ 下载失败:'
+                print(f"[{counts['finished']}/{total}] {mark} {video['title']}")
+            finally:
+                slots.release()
+
+        if not hasattr(videos, '__aiter__'):
+            videos = self.iter_async(videos)
+
+        tasks = set()
+        try:
+            async for video in videos:
+                await slots.acquire()
+                counts['total'] += 1
+                task = asyncio.ensure_future(worker(video))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            counts['listed'] = True
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return counts['downloaded']
+
+    @staticmethod
+    async def iter_async(items):
+        for item in items:
+            yield item
+
+    @staticmethod
+    async def chain_async(*iterables):
+        """依次产出多个列表或异步迭代器中的元素"""
+        for items in iterables:
+            if hasattr(items, '__aiter__'):
+                async for item in items:
+                    yield item
+            else:
+                for item in items:
+                    yield item
+
+    async def pull_repo_async(self, repo_name, incremental=False, stats=None, resume=False):
+        """同步仓库的异步实现，流程与FavRepository.pull_repo相同"""
+        stats = {} if stats is None else stats
+        metrics = SyncMetrics(repo_name, engine='async')
+        with metrics.active(), self.progress.running():
+            ok = await self._pull_repo_async(repo_name, incremental, stats, resume)
+        self.save_pull_metrics(repo_name, metrics, ok, stats)
+        return ok
+
+    async def _pull_repo_async(self, repo_name, incremental, stats, resume=False):
+        metrics = SyncMetrics.current()
+        config = self.start_pull(repo_name)
+        if not config:
+            return False
+
+        # 多仓库同步时复用已打开的会话
+        own_session = self.http is None
+        if own_session:
+            await self.open_session()
+        try:
+            fid = config['fid']
+            journal = self.get_sync_journal(repo_name)
+            listing = {'complete': True}
+            resumed = self.resume_listing(journal, resume)
+            if resumed is not None and resumed[2]:
+                current_videos, full_sync, _ = resumed
+            else:
+                full_sync = not incremental or self.full_sync_due(config)
+                if full_sync:
+                    current_videos = self.iter_favorite_videos_async(fid, status=listing)
+                else:
+                    with metrics.phase('listing'):
+                        print("增量同步: 只获取新增视频")
+                        result = await self.get_new_favorite_videos_async(fid, config['video_list'])
+                    if result is None:
+                        print("获取收藏夹视频列表失败")
+                        return False
+                    current_videos, full_sync = result
+                journal.begin(full_sync)
+                if resumed is not None:
+                    # 先继续上次已列出但未完成的视频，再处理重新获取的列表
+                    current_videos = self.chain_async(resumed[0], current_videos)
+
+            plan = PullPlan(self, repo_name, config, full_sync, journal=None if resumed and resumed[2] else journal)
+            with metrics.phase('download'):
+                downloaded_count = await self.download_videos_async(plan.filter_async(current_videos, listing),
+                                                                    repo_name, config, journal)
+        finally:
+            if own_session:
+                await self.close_session()
+
+        if plan.to_delete is None:
+            return False
+        deleted_count = 0
+        if plan.complete:
+            with metrics.phase('delete'):
+                journal.plan_deletes(plan.to_delete)
+                deleted_count = self.delete_local_videos(repo_name, config, plan.to_delete)
+
+        with metrics.phase('finish'):
+            self.finish_pull(repo_name, config, full_sync and plan.complete, downloaded_count, deleted_count)
+            journal.finish()
+        stats.update(self.make_pull_stats(config, plan.download_count, downloaded_count, deleted_count, plan.complete))
+        return True
+
+    def pull_repo(self, repo_name, workers=None, incremental=False, stats=None, resume=False):
+        """同步仓库，workers指定时覆盖传输并发数"""
+        if workers:
+            self.set_max_transfers(workers)
+        return asyncio.run(self.pull_repo_async(repo_name, incremental, stats, resume))
+
+    async def pull_all_async(self, repo_names, parallel=2, incremental=False, resume=False):
+        """在同一个事件循环中同步多个仓库，共用会话、API并发和传输并发限制"""
+        repo_slots = asyncio.Semaphore(max(1, parallel))
+        results = {}
+
+        async def run(repo_name):
+            stats = {}
+            start = time.time()
+            async with repo_slots:
+                try:
+                    ok = await self.pull_repo_async(repo_name, incremental, stats, resume)
+                    error = None if ok else '同步失败'
+                except Exception as e:
+                    print(f"同步仓库出错 {repo_name}: {e}")
+                    ok, error = False, str(e)
+            stats.update({'ok': ok, 'error': error, 'elapsed': time.time() - start})
+            results[repo_name] = stats
+
+        await self.open_session()
+        try:
+            await asyncio.gather(*[run(repo_name) for repo_name in repo_names])
+        finally:
+            await self.close_session()
+        return results
+
+    def pull_all(self, repo_names=None, parallel=2, workers=None, incremental=False, resume=False):
+        """同时同步多个仓库（默认全部），workers指定时覆盖全局传输并发数"""
+        if repo_names is None:
+            repo_names = self.resolve_repo_names()
+        if not repo_names:
+            print("没有需要同步的仓库")
+            return {}
+
+        if workers:
+            self.set_max_transfers(workers)
+        print(f"开始同步 {len(repo_names)} 个仓库，同时同步 {parallel} 个")
+        results = asyncio.run(self.pull_all_async(repo_names, parallel, incremental, resume))
+        self.print_pull_summary(repo_names, results)
+        return results
@@ -1,16 +1,32 @@
-import requests
-
+import itertools
 import json
 import os
 import re
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
+from ApiCache import ApiCache
+from HttpTransport import HttpTransport
+from MediaStore import MediaStore
+from MirrorSelector import MirrorSelector
+from ProgressReporter import ProgressReporter
+from PullPipeline import PullPipeline
+from PullPlan import PullPlan
+from RepoIndex import RepoIndex
+from RepoStore import RepoStore
+from RepoVerifier import RepoVerifier
+from RateLimiter import RateLimiter
+from SyncJournal import SyncJournal
+from SyncMetrics import SyncMetrics
+
 class FavRepository:
-    def __init__(self, base_dir=None):
+    def __init__(self, base_dir=None, segments=4, min_segment_size=4 * 1024 * 1024, cache=None, api_limiter=None,
+                 max_transfers=16, shared_store=None, stream_ffmpeg=False, post_workers=2, transport=None):
         if base_dir is None:
             base_dir = "bili_repos"
 
@@ -21,8 +37,69 @@ class FavRepository:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Referer': 'https://www.bilibili.com/'
         }
-        self.session = requests.Session()
+        # HTTP会话：API和CDN分别使用连接池，带重试和超时，可传入配置不同的HttpTransport
+        self.session = transport or HttpTransport()
         self.session.headers.update(self.headers)
+        # API地址，可用set_api_base替换为本地模拟服务（见benchmark.py）
+        self.api_base = HttpTransport.API_PREFIX
+
+        # 并发下载时保护配置写入和输出
+        self._lock = threading.Lock()
+        # 已打开的仓库存储 {仓库路径: RepoStore}
+        self._stores = {}
+        # 已打开的同步日志 {仓库路径: SyncJournal}
+        self._journals = {}
+        # 基础目录下的仓库索引
+        self.index = RepoIndex(self.base_dir)
+        # 所有传输共用的进度显示，按固定间隔刷新；quiet为True时只定期输出汇总行
+        self.progress = ProgressReporter()
+
+        # API响应缓存，可传入其他实现了get/set的缓存对象（如ApiCache.NullCache关闭缓存）
+        if cache is None:
+            cache = ApiCache(self.base_dir / ".bili_api_cache.sqlite")
+        self.cache = cache
+
+        # 收藏夹列表接口允许的最大每页数量
+        self.fav_page_size = 20
+        # 所有API请求共用的自适应限速器（不限制CDN传输），可传入以在多个实例间共享
+        self.api_limiter = api_limiter or RateLimiter()
+        # 遇到风控响应时的最大重试次数
+        self.api_max_retries = 4
+
+        # 增量同步模式下，两次完整同步之间的最长间隔（秒）
+        self.full_sync_interval = 7 * 24 * 3600
+        # pull --resume 沿用上次同步的收藏夹列表的最长时间（秒），超过时重新获取列表
+        self.resume_max_age = 2 * 3600
+
+        # 分段下载：每个文件最多使用的连接数，以及每段的最小字节数
+        self.segments = max(1, segments)
+        self.min_segment_size = min_segment_size
+        self.set_pool_size(max(10, self.segments * 2))
+        # 每次从连接读取的字节数范围，读取速度快时逐步加大，减少小块读写的开销
+        self.min_read_size = 64 * 1024
+        self.max_read_size = 4 * 1024 * 1024
+        # CDN镜像选择：记录各主机的首字节时间和速度，下载时使用最快的镜像，传输变慢时切换
+        self.mirrors = MirrorSelector()
+
+        # 同时进行的文件传输总数上限，多个仓库并发同步时共用
+        self.set_max_transfers(max_transfers)
+
+        # 每次同步结束后除了仓库目录下的指标JSON，还可写入Prometheus文本文件（多个仓库共用一个文件）
+        self.prometheus_path = None
+        self._prometheus_summaries = {}
+
+        # 合并/提取音频等ffmpeg后处理的线程数，与下载线程数分开设置
+        self.post_workers = max(1, post_workers)
+
+        # 边下载边合并/提取：数据通过管道直接送入ffmpeg，不写临时文件（失败时不能续传，仅POSIX系统）
+        self.stream_ffmpeg = stream_ffmpeg
+
+        # 共享媒体存储：多个收藏夹中的同一视频只下载一次。为None时，基础目录下已有存储即启用
+        if shared_store is None:
+            shared_store = MediaStore.exists(self.base_dir)
+        self.media_store = MediaStore(self.base_dir) if shared_store else None
+        # 正在写入共享存储的对象 {对象名: 锁}，避免两个仓库同时下载同一个对象
+        self._object_locks = {}
 
         # 清晰度映射
         self.quality_map = {
@@ -36,14 +113,18 @@ class FavRepository:
             16: "流畅 360P"
         }
 
+    def set_api_base(self, api_base):
+        """替换API地址，该地址下的API请求仍使用API连接池"""
+        self.api_base = api_base.rstrip('/')
+        self.session.add_api_prefix(f"{self.api_base}/x/")
+
     def get_favorite_info(self, fid):
         """获取收藏夹基本信息"""
-        url = f"https://api.bilibili.com/x/v3/fav/folder/info"
+        url = f"{self.api_base}/x/v3/fav/folder/info"
         params = {'media_id': fid}
 
         try:
-            response = self.session.get(url, params=params)
-            data = response.json()
+            data = self.api_get(url, params)
 
             if data['code'] != 0:
                 return None
@@ -59,66 +140,186 @@ class FavRepository:
             print(f"获取收藏夹信息失败: {e}")
             return None
 
-    def get_favorite_videos(self, fid):
-        """获取收藏夹中的视频列表"""
-        videos = []
-        page = 1
+    def fetch_favorite_page(self, fid, page):
+        """获取收藏夹的一页内容，返回(medias, has_more)，出错时返回None"""
+        url = f"{self.api_base}/x/v3/fav/resource/list"
+        params = {
+            'media_id': fid,
+            'pn': page,
+            'ps': self.fav_page_size,
+            'keyword': '',
+            'order': 'mtime',
+            'type': 0,
+            'tid': 0,
+            'platform': 'web'
+        }
 
-        while True:
-            url = f"https://api.bilibili.com/x/v3/fav/resource/list"
-            params = {
-                'media_id': fid,
-                'pn': page,
-                'ps': 20,
-                'keyword': '',
-                'order': 'mtime',
-                'type': 0,
-                'tid': 0,
-                'platform': 'web'
-            }
+        try:
+            data = self.api_get(url, params)
 
+            if data['code'] != 0:
+                print(f"获取收藏夹失败: {data.get('message', '未知错误')}")
+                if data['code'] == -403:
+                    print("收藏夹可能是私密的或需要登录访问")
+                return None
+
+            return data['data']['medias'] or [], data['data'].get('has_more', False)
+        except Exception as e:
+            print(f"获取收藏夹出错: {e}")
+            return None
+
+    def api_get(self, url, params):
+        """请求API并返回JSON数据，可缓存的接口优先读取缓存，只缓存成功的响应"""
+        endpoint = urlparse(url).path
+        metrics = SyncMetrics.current()
+        data = self.cache.get(endpoint, params)
+        if data is not None:
+            metrics.api_cache_hit(endpoint)
+            return data
+
+        for attempt in range(self.api_max_retries + 1):
+            self.api_limiter.acquire()
+            start = time.time()
             try:
                 response = self.session.get(url, params=params)
-                data = response.json()
+            except Exception:
+                metrics.api_error(endpoint)
+                raise
+            finally:
+                metrics.api_request(endpoint, time.time() - start, retry=attempt > 0)
+            data = self.parse_api_response(response.status_code, response.text)
+            if not self.is_throttled(data):
+                break
 
-                if data['code'] != 0:
-                    print(f"获取收藏夹失败: {data.get('message', '未知错误')}")
-                    if data['code'] == -403:
-                        print("收藏夹可能是私密的或需要登录访问")
-                    break
+            metrics.api_throttled(endpoint)
+            self.api_limiter.on_throttle()
+            if attempt < self.api_max_retries:
+                delay = self.api_limiter.backoff_delay(attempt)
+                print(f"请求被B站风控限制 (code {data['code']})，{delay:.1f} 秒后重试...")
+                time.sleep(delay)
 
-                medias = data['data']['medias']
+        if data.get('code') == 0:
+            self.api_limiter.on_success()
+            self.cache.set(endpoint, params, data)
+        else:
+            metrics.api_error(endpoint)
+        return data
+
+    # B站风控相关的返回码，HTTP状态码也会被转换为同样的形式
+    THROTTLE_CODES = (-412, -799, 412, 429)
+
+    def parse_api_response(self, status_code, text):
+        """解析API响应，HTTP层面的限流转换为带code的数据，以便统一处理"""
+        if status_code in (412, 429):
+            return {'code': status_code, 'message': f'HTTP {status_code}'}
+        return json.loads(text)
+
+    def is_throttled(self, data):
+        """响应是否为风控/限流"""
+        return data.get('code') in self.THROTTLE_CODES
+
+    def get_favorite_videos(self, fid, media_count=None, workers=4):
+        """获取收藏夹中的视频列表，已知视频总数时并发获取各页"""
+        return list(self.iter_favorite_videos(fid, media_count, workers))
+
+    def iter_favorite_videos(self, fid, media_count=None, workers=4, status=None):
+        """按页序逐个产出收藏夹中的视频，已知视频总数时最多提前获取workers页
+
+        遇到失败的页则停止（与逐页获取时的行为一致）；传入status字典时，结束后填入complete表示是否获取了完整列表
+        """
+        status = {} if status is None else status
+        status['complete'] = False
+        if media_count is None:
+            fav_info = self.get_favorite_info(fid)
+            media_count = fav_info['media_count'] if fav_info else 0
+
+        page_count = -(-media_count // self.fav_page_size)
+        seen = set()
+        page = 1
+        next_page = 1
+        futures = {}
+        has_more = page_count == 0
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, page_count))) as executor:
+            while page <= page_count or has_more:
+                # 已知页数内保持workers页同时获取，下游处理得慢时不再继续提前获取
+                while next_page <= page_count and next_page < page + workers:
+                    futures[next_page] = executor.submit(SyncMetrics.bind(self.fetch_favorite_page), fid, next_page)
+                    next_page += 1
+
+                if page in futures:
+                    result = futures.pop(page).result()
+                else:
+                    # 获取期间收藏夹有新增，继续逐页获取剩余内容
+                    result = self.fetch_favorite_page(fid, page)
+                if result is None:
+                    return
+
+                medias, has_more = result
                 if not medias:
                     break
 
                 for media in medias:
-                    if media['type'] == 2:  # 视频类型
-                        videos.append({
-                            'bvid': media['bvid'],
-                            'title': self.clean_filename(media['title']),
-                            'upper': media['upper']['name'],
-                            'duration': media['duration'],
-                            'pubdate': media['pubtime']
-                        })
-
-                print(f"已获取第 {page} 页，共 {len(medias)} 个视频")
+                    if media['type'] == 2 and media['bvid'] not in seen:  # 视频类型
+                        seen.add(media['bvid'])
+                        yield self.make_video_entry(media)
                 page += 1
-                time.sleep(0.5)  # 避免请求过快
 
-            except Exception as e:
-                print(f"获取收藏夹出错: {e}")
-                break
+        print(f"已获取 {page - 1} 页")
+        status['complete'] = True
+
+    def make_video_entry(self, media):
+        """将收藏夹接口返回的media转换为视频信息"""
+        return {
+            'bvid': media['bvid'],
+            'title': self.clean_filename(media['title']),
+            'upper': media['upper']['name'],
+            'duration': media['duration'],
+            'pubdate': media['pubtime'],
+            'fav_time': media.get('fav_time'),
+            # 第一个分P的cid和分P数，下载时可省去一次view接口请求
+            'cid': (media.get('ugc') or {}).get('first_cid'),
+            'page_count': media.get('page')
+        }
+
+    def get_new_favorite_videos(self, fid, video_list):
+        """增量获取收藏夹新增的视频，遇到已记录且收藏时间未变的视频即停止翻页
+
+        返回(新增视频列表, 是否已获取完整列表)，出错时返回None
+        """
+        videos = []
+        seen = set()
+        page = 1
+
+        while True:
+            result = self.fetch_favorite_page(fid, page)
+            if result is None:
+                return None
+
+            medias, has_more = result
+            for media in medias:
+                if media['type'] != 2 or media['bvid'] in seen:  # 只处理视频类型
+                    continue
+
+                known = video_list.get(media['bvid'])
+                if known and known.get('fav_time') is not None and known.get('fav_time') == media.get('fav_time'):
+                    print(f"已获取第 {page} 页，遇到已同步的视频，停止翻页")
+                    return videos, False
 
-        return videos
+                seen.add(media['bvid'])
+                videos.append(self.make_video_entry(media))
+
+            print(f"已获取第 {page} 页，共 {len(medias)} 个视频")
+            if not medias or not has_more:
+                return videos, True
+            page += 1
 
     def get_video_info(self, bvid):
         """获取视频详细信息"""
-        url = f"https://api.bilibili.com/x/web-interface/view"
+        url = f"{self.api_base}/x/web-interface/view"
         params = {'bvid': bvid}
 
         try:
-            response = self.session.get(url, params=params)
-            data = response.json()
+            data = self.api_get(url, params)
 
             if data['code'] != 0:
                 return None
@@ -128,10 +329,9 @@ class FavRepository:
             print(f"获取视频信息失败: {e}")
             return None
 
-    def get_video_download_url(self, bvid, cid, quality=80):
-        """获取视频下载链接"""
-        url = "https://api.bilibili.com/x/player/playurl"
-        params = {
+    def playurl_params(self, bvid, cid, quality):
+        """下载链接接口的请求参数"""
+        return {
             'bvid': bvid,
             'cid': cid,
             'qn': quality,
@@ -139,81 +339,558 @@ class FavRepository:
             'fourk': 1
         }
 
+    def get_video_download_url(self, bvid, cid, quality=80):
+        """获取视频下载链接"""
+        url = f"{self.api_base}/x/player/playurl"
+        params = self.playurl_params(bvid, cid, quality)
+
         try:
-            response = self.session.get(url, params=params)
-            data = response.json()
+            data = self.api_get(url, params)
 
             if data['code'] != 0:
+                if self.is_throttled(data):
+                    print(f"获取下载链接失败: 重试后仍被风控限制 (code {data['code']})")
                 return None, None
 
-            play_info = data['data']
-            if 'dash' in play_info:
-                # DASH格式
-                video_url = play_info['dash']['video'][0]['baseUrl'] if play_info['dash']['video'] else None
-                audio_url = play_info['dash']['audio'][0]['baseUrl'] if play_info['dash']['audio'] else None
-                actual_quality = play_info['quality']
-                return {'video': video_url, 'audio': audio_url}, actual_quality
-            else:
-                # 传统格式
-                video_url = play_info['durl'][0]['url']
-                return {'video': video_url, 'audio': None}, play_info['quality']
+            return self.parse_play_info(data['data'])
 
         except Exception as e:
             print(f"获取下载链接失败: {e}")
             return None, None
 
-    def download_file(self, url, filepath):
-        """下载文件"""
-        try:
-            response = self.session.get(url, stream=True)
-            response.raise_for_status()
+    def parse_play_info(self, play_info):
+        """从下载链接接口的数据中取出视频和音频的候选链接列表（含备用镜像），返回(urls, 实际清晰度)"""
+        if 'dash' in play_info:
+            # DASH格式
+            video_urls = self.stream_candidates(play_info['dash']['video'])
+            audio_urls = self.stream_candidates(play_info['dash']['audio'])
+            actual_quality = play_info['quality']
+            return {'video': video_urls, 'audio': audio_urls}, actual_quality
+        else:
+            # 传统格式
+            durl = play_info['durl'][0]
+            video_urls = MirrorSelector.candidates([durl['url']] + (durl.get('backup_url') or []))
+            return {'video': video_urls, 'audio': None}, play_info['quality']
+
+    def stream_candidates(self, streams):
+        """与首选流清晰度和编码相同的所有流条目的主链接和备用链接，首选流的主链接在最前"""
+        if not streams:
+            return None
+        first = streams[0]
+        urls = []
+        for stream in streams:
+            if stream.get('id') != first.get('id') or stream.get('codecid') != first.get('codecid'):
+                continue
+            urls.append(stream.get('baseUrl') or stream.get('base_url'))
+            urls.extend(stream.get('backupUrl') or stream.get('backup_url') or [])
+        return MirrorSelector.candidates(urls)
+
+    def set_max_transfers(self, max_transfers):
+        """设置同时进行的文件传输总数上限"""
+        self.max_transfers = max(1, max_transfers)
+        self._transfer_slots = threading.BoundedSemaphore(self.max_transfers)
+
+    def download_file(self, url, filepath, cancel_event=None, show_progress=True):
+        """下载文件，先写入.part文件，完成后原子重命名；中断后再次调用会续传缺失部分
+
+        url可以是同一文件的多个镜像链接组成的列表，会选择最快的镜像
+        """
+        with self._transfer_slots:
+            return self.download_file_resumable(url, filepath, cancel_event, show_progress)
+
+    def download_file_resumable(self, url, filepath, cancel_event=None, show_progress=True):
+        """download_file的实现，调用方负责占用传输名额"""
+        filepath = Path(filepath)
+        part_path = filepath.with_name(filepath.name + '.part')
+        state_path = filepath.with_name(filepath.name + '.part.json')
 
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
+        try:
+            urls, total_size = self.select_mirrors(self.mirrors.candidates(url))
+            if total_size is None:
+                # 服务器不支持Range，只能整体重新下载
+                return self.download_file_stream(urls[0], filepath, part_path, cancel_event, show_progress)
+
+            # 上次已完整下载
+            if filepath.exists() and not part_path.exists() and filepath.stat().st_size == total_size:
+                return True
+
+            done = self.load_part_state(state_path, part_path, total_size)
+            if done:
+                resumed = sum(end - start + 1 for start, end in done)
+                print(f"继续未完成的下载: 已有 {resumed / total_size * 100:.1f}%")
+            else:
+                # 预分配文件
+                with open(part_path, 'wb') as f:
+                    f.truncate(total_size)
 
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            percent = (downloaded / total_size) * 100
-                            print(f"\r下载进度: {percent:.1f}%", end='', flush=True)
+            if not self.download_file_ranges(urls, part_path, state_path, total_size, done, cancel_event, show_progress):
+                return False
 
-            print()  # 换行
+            os.replace(part_path, filepath)
+            if state_path.exists():
+                os.remove(state_path)
             return True
         except Exception as e:
             print(f"下载失败: {e}")
             return False
 
-    def merge_video_audio(self, video_path, audio_path, output_path):
-        """合并视频和音频"""
-        cmd = [
-            'ffmpeg', '-i', video_path, '-i', audio_path,
-            '-c', 'copy', '-y', output_path
-        ]
+    def download_file_stream(self, url, filepath, part_path, cancel_event=None, show_progress=True):
+        """单连接流式下载，用于不支持Range的服务器"""
+        start = time.time()
+        response = self.session.get(url, stream=True)
+        response.raise_for_status()
+
+        total_size = int(response.headers.get('content-length', 0))
+        downloaded = 0
+        progress_id = self.progress.start(Path(filepath).name, total_size) if show_progress else None
 
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"合并失败: {e}")
+            with open(part_path, 'wb') as f:
+                for chunk in self.iter_response(response):
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    if progress_id is not None:
+                        self.progress.update(progress_id, len(chunk))
+        except Exception:
+            # 无法续传，丢弃不完整的文件
+            os.remove(part_path)
+            raise
+        finally:
+            response.close()
+            if progress_id is not None:
+                self.progress.finish(progress_id)
+            self.record_transfer(url, downloaded, time.time() - start)
+
+        if (cancel_event is not None and cancel_event.is_set()) or (total_size and downloaded != total_size):
+            os.remove(part_path)
             return False
 
+        os.replace(part_path, filepath)
+        return True
+
+    def record_transfer(self, url, nbytes, seconds):
+        """记录一次CDN传输，计入同步指标和镜像测速"""
+        SyncMetrics.current().add_transfer(url, nbytes, seconds)
+        self.mirrors.record_transfer(url, nbytes, seconds)
+
+    def iter_response(self, response):
+        """按自适应大小读取响应数据：读取大小只是上限，每次返回已到达的数据，不等凑满；
+        读满上限且很快时加倍上限，读取变慢时减半"""
+        raw = response.raw
+        read1 = getattr(raw, 'read1', None)
+        size = self.min_read_size
+        while True:
+            began = time.time()
+            if read1 is not None:
+                chunk = read1(size, decode_content=True)
+            else:
+                # 旧版urllib3没有read1，read会等凑满size字节，只能固定使用最小读取大小限制等待时间
+                chunk = raw.read(self.min_read_size, decode_content=True)
+            if not chunk:
+                return
+            elapsed = time.time() - began
+            if len(chunk) == size and elapsed < 0.05:
+                size = min(size * 2, self.max_read_size)
+            elif elapsed > 0.5:
+                size = max(size // 2, self.min_read_size)
+            yield chunk
+
+    def select_mirrors(self, urls):
+        """并行探测尚未测速的镜像主机，返回(按速度排序的链接, 文件总大小)；都不支持Range时总大小为None"""
+        sizes = {}
+        pending = self.mirrors.unprobed(urls) if len(urls) > 1 else []
+
+        def probe(url):
+            sizes[url] = self.probe_mirror(url)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                list(executor.map(probe, pending))
+
+        urls = self.mirrors.rank(urls)
+        for url in urls:
+            if url not in sizes:
+                sizes[url] = self.probe_range_support(url)
+            if sizes[url] is not None:
+                # 续传记录与镜像无关，各镜像提供的是同一个文件
+                return [url] + [other for other in urls if other != url], sizes[url]
+        return urls, None
+
+    def probe_mirror(self, url):
+        """用一个小的Range请求测量镜像的首字节时间和速度，返回文件总大小；不支持Range的镜像不能续传，视为探测失败"""
+        start = time.time()
+        try:
+            response = self.session.get(url, headers={'Range': f'bytes=0-{self.mirrors.probe_size - 1}'}, stream=True)
+            try:
+                ttfb = time.time() - start
+                total = self.content_range_total(response.status_code, response.headers)
+                if total is not None:
+                    nbytes = sum(len(chunk) for chunk in response.iter_content(chunk_size=65536))
+            finally:
+                response.close()
+        except Exception:
+            total = None
+
+        if total is None:
+            self.mirrors.record_probe(url, None)
+        else:
+            self.mirrors.record_probe(url, ttfb, nbytes, time.time() - start - ttfb)
+        return total
+
+    def probe_range_support(self, url):
+        """探测服务器是否支持Range请求，支持时返回文件总大小，否则返回None"""
+        try:
+            response = self.session.get(url, headers={'Range': 'bytes=0-0'}, stream=True)
+            response.close()
+        except Exception:
+            return None
+        return self.content_range_total(response.status_code, response.headers)
+
+    def content_range_total(self, status, headers):
+        """从206响应的Content-Range中取出文件总大小"""
+        content_range = headers.get('content-range', '')
+        if status != 206 or '/' not in content_range:
+            return None
+
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+
+    def load_part_state(self, state_path, part_path, total_size):
+        """读取.part文件的续传记录，返回已完成的字节区间；记录无效时返回空列表"""
+        if not part_path.exists() or not state_path.exists():
+            return []
+
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception:
+            return []
+
+        if state.get('size') != total_size or part_path.stat().st_size != total_size:
+            return []
+        return [tuple(r) for r in state.get('done', [])]
+
+    def save_part_state(self, state_path, total_size, done):
+        """保存续传记录：文件总大小和已完成的字节区间
+
+        done中只能包含已flush的区间；写入记录前先将.part文件同步到磁盘，
+        进程被杀或断电后记录中标为完成的区间一定已在文件中
+        """
+        part_path = state_path.with_name(state_path.name[:-len('.json')])
+        if part_path.exists():
+            with open(part_path, 'rb') as f:
+                os.fsync(f.fileno())
+
+        tmp_path = state_path.with_name(state_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'size': total_size, 'done': done}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, state_path)
+
+    def merge_ranges(self, ranges):
+        """合并相邻或重叠的字节区间"""
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def missing_ranges(self, total_size, done):
+        """计算尚未下载的字节区间"""
+        missing = []
+        pos = 0
+        for start, end in self.merge_ranges(done):
+            if start > pos:
+                missing.append((pos, start - 1))
+            pos = max(pos, end + 1)
+        if pos < total_size:
+            missing.append((pos, total_size - 1))
+        return missing
+
+    def split_ranges(self, start, end):
+        """将字节区间按段数和最小段大小切分为多个子区间"""
+        size = end - start + 1
+        count = max(1, min(self.segments, size // self.min_segment_size))
+        step = size // count
+        ranges = []
+        for i in range(count):
+            seg_start = start + i * step
+            seg_end = end if i == count - 1 else seg_start + step - 1
+            ranges.append((seg_start, seg_end))
+        return ranges
+
+    def download_file_ranges(self, urls, part_path, state_path, total_size, done, cancel_event=None, show_progress=True):
+        """按字节区间下载缺失部分，多段时使用多个连接，每段写入文件的对应偏移
+
+        urls为同一文件的镜像链接（最快的在前），某段传输出错或明显变慢时，剩余部分改从其他镜像下载
+        """
+        urls = self.mirrors.candidates(urls)
+        tasks = []
+        for start, end in self.missing_ranges(total_size, done):
+            tasks.extend(self.split_ranges(start, end))
+
+        failed = threading.Event()
+        state_lock = threading.Lock()
+        done = list(done)
+        last_save = [time.time()]
+        progress_id = None
+        if show_progress:
+            progress_id = self.progress.start(part_path.name[:-len('.part')], total_size,
+                                              sum(end - start + 1 for start, end in done))
+
+        def mark_done(start, end):
+            if progress_id is not None:
+                self.progress.update(progress_id, end - start + 1)
+            with state_lock:
+                done.append((start, end))
+                done[:] = self.merge_ranges(done)
+                # 定期保存续传记录
+                if time.time() - last_save[0] >= 1:
+                    self.save_part_state(state_path, total_size, done)
+                    last_save[0] = time.time()
+
+        def stopped():
+            return failed.is_set() or (cancel_event is not None and cancel_event.is_set())
+
+        def fetch_from(url, pos, end, alternatives):
+            """从一个镜像下载[pos, end]，返回(新位置, 状态, 错误)，状态为done、slow、cancelled或error"""
+            began = time.time()
+            start = pos
+            response = None
+            try:
+                response = self.session.get(url, headers={'Range': f'bytes={pos}-{end}'}, stream=True)
+                if response.status_code != 206:
+                    raise IOError(f"服务器未返回分段内容 (HTTP {response.status_code})")
+
+                window_start, window_bytes = time.time(), 0
+                with open(part_path, 'r+b') as f:
+                    f.seek(pos)
+                    for chunk in self.iter_response(response):
+                        if stopped():
+                            return pos, 'cancelled', None
+                        f.write(chunk)
+                        # 区间写出缓冲区后才记为完成，续传记录中不会有仍在内存中的数据
+                        f.flush()
+                        mark_done(pos, pos + len(chunk) - 1)
+                        pos += len(chunk)
+
+                        window_bytes += len(chunk)
+                        elapsed = time.time() - window_start
+                        if elapsed >= self.mirrors.window:
+                            if self.mirrors.should_switch(url, window_bytes / elapsed, alternatives):
+                                return pos, 'slow', None
+                            window_start, window_bytes = time.time(), 0
+
+                if pos != end + 1:
+                    raise IOError(f"分段 {start}-{end} 不完整")
+                return pos, 'done', None
+            except Exception as e:
+                return pos, 'error', e
+            finally:
+                if response is not None:
+                    response.close()
+                self.record_transfer(url, pos - start, time.time() - began)
+
+        def fetch(start, end):
+            pos = start
+            tried = []
+            url = urls[0]
+            retries = 0
+            error_pos = start
+            while True:
+                tried.append(url)
+                alternatives = [other for other in self.mirrors.rank(urls) if other not in tried]
+                pos, status, error = fetch_from(url, pos, end, alternatives)
+                if status == 'done':
+                    return True
+                if status == 'cancelled':
+                    return False
+                if status == 'error':
+                    self.mirrors.record_failure(url)
+                    # 两次出错之间有进展时重新计算重试次数
+                    if pos > error_pos:
+                        retries = 0
+                    error_pos = pos
+                    if stopped() or (not alternatives and retries >= self.session.retries):
+                        failed.set()
+                        raise error
+                    if not alternatives:
+                        # 没有其他镜像时，稍后从断开的位置重试同一个链接
+                        time.sleep(self.session.backoff_delay(retries))
+                        retries += 1
+                        continue
+                # 剩余部分改从下一个镜像下载
+                url = alternatives[0]
+
+        errors = []
+        results = []
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.segments, len(tasks)) or 1) as executor:
+                futures = [executor.submit(SyncMetrics.bind(fetch), start, end) for start, end in tasks]
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        errors.append(e)
+                        results.append(False)
+        finally:
+            if progress_id is not None:
+                self.progress.finish(progress_id)
+            with state_lock:
+                self.save_part_state(state_path, total_size, done)
+
+        if errors:
+            print(f"下载失败: {errors[0]}")
+        return all(results) and self.missing_ranges(total_size, done) == []
+
+    def download_streams(self, jobs):
+        """并行下载多个流[(url, 文件路径), ...]，任一失败则取消其余下载，未完成部分保留用于续传"""
+        cancel_event = threading.Event()
+
+        def fetch(url, filepath):
+            ok = self.download_file(url, filepath, cancel_event)
+            if not ok:
+                cancel_event.set()
+            return ok
+
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [executor.submit(SyncMetrics.bind(fetch), url, filepath) for url, filepath in jobs]
+            results = [future.result() for future in futures]
+
+        return all(results)
+
+    def merge_video_audio(self, video_path, audio_path, output_path):
+        """合并视频和音频"""
+        return self.run_ffmpeg(['-i', video_path, '-i', audio_path, '-c', 'copy'], output_path, "合并")
+
     def extract_audio(self, video_path, audio_path):
         """提取音频"""
-        cmd = [
-            'ffmpeg', '-i', video_path,
-            '-vn', '-acodec', 'copy', '-y', audio_path
-        ]
+        return self.run_ffmpeg(['-i', video_path, '-vn', '-acodec', 'copy'], audio_path, "提取音频")
+
+    def run_ffmpeg(self, args, output_path, action):
+        """运行ffmpeg并写入同目录下的临时文件，成功后再替换最终文件
+
+        失败或被中断时已有的同名文件（如提高清晰度前下载的视频）保持不变，也不会留下不完整的文件
+        """
+        output_path = Path(output_path)
+        tmp_path = output_path.with_name(f"{output_path.stem}.tmp{output_path.suffix}")
+        cmd = ['ffmpeg'] + [str(arg) for arg in args] + ['-y', str(tmp_path)]
 
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            return True
+            with SyncMetrics.current().stage('ffmpeg'):
+                subprocess.run(cmd, check=True, capture_output=True)
         except subprocess.CalledProcessError as e:
-            print(f"提取音频失败: {e}")
+            print(f"{action}失败: {e}")
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            return False
+
+        os.replace(tmp_path, output_path)
+        return True
+
+    def can_stream_ffmpeg(self):
+        """ffmpeg通过继承的管道描述符读取输入，仅POSIX系统支持"""
+        return self.stream_ffmpeg and os.name == 'posix'
+
+    def stream_merge_video_audio(self, video_url, audio_url, output_path):
+        """边下载边合并视频和音频"""
+        return self.stream_to_ffmpeg([video_url, audio_url], ['-c', 'copy'], output_path)
+
+    def stream_extract_audio(self, video_url, audio_path):
+        """边下载边提取音频"""
+        return self.stream_to_ffmpeg([video_url], ['-vn', '-acodec', 'copy'], audio_path)
+
+    def stream_to_ffmpeg(self, urls, output_args, output_path):
+        """下载多个输入流并直接通过管道送入ffmpeg，整个任务占用一个传输名额"""
+        with self._transfer_slots:
+            return self._stream_to_ffmpeg(urls, output_args, output_path)
+
+    def _stream_to_ffmpeg(self, urls, output_args, output_path):
+        with SyncMetrics.current().stage('ffmpeg_stream'):
+            return self._run_stream_to_ffmpeg(urls, output_args, output_path)
+
+    def _run_stream_to_ffmpeg(self, urls, output_args, output_path):
+        output_path = Path(output_path)
+        tmp_path = output_path.with_name(f"{output_path.stem}.tmp{output_path.suffix}")
+
+        pipes = [os.pipe() for _ in urls]
+        cmd = ['ffmpeg', '-nostdin']
+        for read_fd, _ in pipes:
+            cmd += ['-i', f'pipe:{read_fd}']
+        cmd += output_args + ['-y', str(tmp_path)]
+
+        try:
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE, pass_fds=[read_fd for read_fd, _ in pipes])
+        except OSError as e:
+            for read_fd, write_fd in pipes:
+                os.close(read_fd)
+                os.close(write_fd)
+            print(f"启动ffmpeg失败: {e}")
+            return False
+        # 读端已由ffmpeg继承
+        for read_fd, _ in pipes:
+            os.close(read_fd)
+
+        errors = []
+
+        def feed(url, write_fd):
+            written = 0
+            progress_id = None
+            try:
+                with os.fdopen(write_fd, 'wb') as pipe:
+                    # 管道不能重新开始，只在开始前选择最快的镜像
+                    url = self.select_mirrors(self.mirrors.candidates(url))[0][0]
+                    start = time.time()
+                    response = self.session.get(url, stream=True)
+                    try:
+                        response.raise_for_status()
+                        progress_id = self.progress.start(output_path.name,
+                                                          int(response.headers.get('content-length', 0)))
+                        for chunk in self.iter_response(response):
+                            pipe.write(chunk)
+                            written += len(chunk)
+                            if progress_id is not None:
+                                self.progress.update(progress_id, len(chunk))
+                    finally:
+                        response.close()
+                        if progress_id is not None:
+                            self.progress.finish(progress_id)
+                        self.record_transfer(url, written, time.time() - start)
+            except BrokenPipeError:
+                # ffmpeg已退出，结果以其退出码为准
+                pass
+            except Exception as e:
+                errors.append(e)
+                process.kill()
+
+        # 每个输入一个线程，ffmpeg按需从各管道读取，写满的管道会阻塞对应的下载
+        feeders = [threading.Thread(target=SyncMetrics.bind(feed), args=(url, write_fd), daemon=True)
+                   for url, (_, write_fd) in zip(urls, pipes)]
+        for feeder in feeders:
+            feeder.start()
+        _, stderr = process.communicate()
+        for feeder in feeders:
+            feeder.join()
+
+        if errors or process.returncode != 0:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            if errors:
+                print(f"流式下载失败: {errors[0]}")
+            else:
+                lines = stderr.decode('utf-8', errors='ignore').strip().splitlines()
+                print(f"ffmpeg处理失败: {lines[-1] if lines else process.returncode}")
             return False
 
+        os.replace(tmp_path, output_path)
+        return True
+
     def clean_filename(self, filename):
         """清理文件名"""
         # 移除或替换不合法的字符
@@ -237,16 +914,32 @@ class FavRepository:
 
     def get_repo_config_path(self, repo_name):
         """获取仓库配置文件路径"""
-        return self.get_repo_path(repo_name) / ".bili_repo.json"
+        return self.get_repo_path(repo_name) / RepoStore.DB_NAME
+
+    def repo_exists(self, repo_name):
+        """仓库是否已初始化（包括尚未迁移的旧版JSON仓库）"""
+        return RepoStore.exists(self.get_repo_path(repo_name))
+
+    def get_repo_store(self, repo_name):
+        """获取仓库存储，首次打开旧版JSON仓库时自动迁移"""
+        repo_path = self.get_repo_path(repo_name)
+        key = str(repo_path)
+        with self._lock:
+            if key not in self._stores:
+                self._stores[key] = RepoStore(repo_path)
+            return self._stores[key]
+
+    def get_sync_journal(self, repo_name):
+        """获取仓库的同步日志"""
+        key = str(self.get_repo_path(repo_name))
+        with self._lock:
+            if key not in self._journals:
+                self._journals[key] = SyncJournal(key)
+            return self._journals[key]
 
     def get_next_repo_id(self):
         """获取下一个可用的仓库ID"""
-        existing_ids = set()
-        for item in self.base_dir.iterdir():
-            if item.is_dir():
-                config = self.load_repo_config(item.name)
-                if config and 'repo_id' in config:
-                    existing_ids.add(config['repo_id'])
+        existing_ids = {entry['repo_id'] for entry in self.index.entries().values() if entry.get('repo_id') is not None}
 
         # 找到最小的未使用ID
         repo_id = 1
@@ -256,11 +949,9 @@ class FavRepository:
 
     def find_repo_by_id(self, repo_id):
         """通过ID查找仓库"""
-        for item in self.base_dir.iterdir():
-            if item.is_dir():
-                config = self.load_repo_config(item.name)
-                if config and config.get('repo_id') == repo_id:
-                    return item.name
+        for repo_name, entry in self.index.entries().items():
+            if entry.get('repo_id') == repo_id:
+                return repo_name
         return None
 
     def init_repo(self, fid, repo_name=None, quality=80, audio_only=True):
@@ -278,10 +969,9 @@ class FavRepository:
             repo_name = fav_info['title']
 
         repo_path = self.get_repo_path(repo_name)
-        config_path = self.get_repo_config_path(repo_name)
 
         # 检查仓库是否已存在
-        if config_path.exists():
+        if self.repo_exists(repo_name):
             print(f"仓库 '{repo_name}' 已存在")
             return False
 
@@ -305,8 +995,8 @@ class FavRepository:
             'video_list': {}
         }
 
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        if not self.save_repo_config(repo_name, config):
+            return False
 
         print(f"✓ 仓库已初始化: {repo_path}")
         print(f"  仓库ID: {repo_id}")
@@ -323,147 +1013,430 @@ class FavRepository:
 
         return success
 
-    def load_repo_config(self, repo_name):
-        """加载仓库配置"""
-        config_path = self.get_repo_config_path(repo_name)
-        if not config_path.exists():
+    def load_repo_config(self, repo_name, with_videos=True):
+        """加载仓库配置，with_videos为False时不读取video_list"""
+        if not self.repo_exists(repo_name):
             return None
 
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return self.get_repo_store(repo_name).load_config(with_videos)
         except Exception as e:
             print(f"加载仓库配置失败: {e}")
             return None
 
     def save_repo_config(self, repo_name, config):
-        """保存仓库配置"""
-        config_path = self.get_repo_config_path(repo_name)
+        """保存仓库配置（包括完整的video_list）"""
         try:
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
+            self.get_repo_store(repo_name).save_config(config)
+            self.index.update(repo_name, config, len(config['video_list']))
             return True
         except Exception as e:
             print(f"保存仓库配置失败: {e}")
             return False
 
-    def download_video(self, video_info, repo_path, quality=80, audio_only=True):
-        """下载单个视频"""
+    def resolve_video(self, video_info, quality):
+        """获取视频的cid和下载链接，返回(cid, urls)，失败返回None"""
         bvid = video_info['bvid']
-        title = video_info['title']
 
-        print(f"正在下载: {title}")
-
-        # 获取视频详细信息
-        detail = self.get_video_info(bvid)
-        if not detail:
-            print("获取视频详细信息失败")
-            return False
+        # 收藏夹列表已提供第一个分P的cid时无需再请求视频详细信息
+        cid = video_info.get('cid')
+        if not cid:
+            detail = self.get_video_info(bvid)
+            if not detail:
+                print("获取视频详细信息失败")
+                return None
 
-        # 获取第一个分P的cid
-        cid = detail['pages'][0]['cid']
+            # 获取第一个分P的cid
+            cid = detail['pages'][0]['cid']
 
         # 获取下载链接
         urls, actual_quality = self.get_video_download_url(bvid, cid, quality)
         if not urls:
             print("获取下载链接失败")
-            return False
+            return None
 
         quality_desc = self.quality_map.get(actual_quality, f"未知({actual_quality})")
         print(f"实际清晰度: {quality_desc}")
+        return cid, urls
 
+    def invalidate_download_url(self, bvid, cid, quality):
+        """缓存的下载链接可能已失效，下次重新获取"""
+        self.cache.invalidate('/x/player/playurl', self.playurl_params(bvid, cid, quality))
+
+    def object_lock(self, key):
+        with self._lock:
+            return self._object_locks.setdefault(key, threading.Lock())
+
+    def link_stored_media(self, key, title, repo_path, audio_only):
+        """共享存储中已有该对象时链接到仓库，返回是否成功"""
+        extension = '.m4a' if audio_only else '.mp4'
+        if not self.media_store.has(key, extension):
+            return False
+
+        try:
+            link_type = self.media_store.link(key, extension, repo_path / f"{title}{extension}")
+            print(f"✓ 已从共享存储链接 ({link_type})")
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"链接共享文件失败: {e}")
+            return False
+
+    def discard_stored_media(self, file_path):
+        """文件链接到的共享对象损坏时删除该对象，其他仓库中的链接也一并删除（硬链接与对象内容相同，同样损坏）
+
+        返回被删除链接的引用路径列表，文件不是共享存储中的链接时返回None
+        """
+        if not self.media_store:
+            return None
+        name = self.media_store.object_of(file_path)
+        if name is None:
+            return None
+        # 对象名去掉扩展名即对象键，与下载和链接使用同一个锁
+        with self.object_lock(Path(name).stem):
+            return self.media_store.discard(name)
+
+    def remove_media_file(self, file_path):
+        """删除仓库中的媒体文件；共享存储中的链接只删除链接，对象无人引用时才一并删除
+
+        共享对象的链接在对象锁内删除，不会删掉其他线程刚下载完、尚未链接的对象
+        """
+        if self.media_store:
+            name = self.media_store.object_of(file_path)
+            if name is not None:
+                with self.object_lock(Path(name).stem):
+                    if self.media_store.release(file_path):
+                        return
+        os.remove(file_path)
+
+    def transfer_media(self, urls, title, repo_path, audio_only=True):
+        """下载阶段：只负责网络传输，返回待执行的后处理任务，失败返回None
+
+        后处理任务为 ('done', 最终文件)、('extract', 临时视频, 音频文件)
+        或 ('merge', 临时视频, 临时音频, 最终文件)
+        """
         if audio_only:
+            audio_file = repo_path / f"{title}.m4a"
             # 仅下载音频
             if urls['audio']:
-                audio_file = repo_path / f"{title}.m4a"
                 print("下载音频...")
                 if self.download_file(urls['audio'], audio_file):
                     print(f"✓ 音频下载完成")
-                    return True
-            else:
-                # 如果没有单独音频流，下载视频后提取音频
-                video_file = repo_path / f"{title}_temp.mp4"
-                audio_file = repo_path / f"{title}.m4a"
-
-                print("下载视频...")
-                if self.download_file(urls['video'], video_file):
-                    print("提取音频...")
-                    if self.extract_audio(video_file, audio_file):
-                        os.remove(video_file)  # 删除临时视频文件
-                        print(f"✓ 音频提取完成")
-                        return True
-                    else:
-                        os.remove(video_file)
-        else:
-            # 下载视频
-            if urls['audio'] and urls['video']:
-                # DASH格式，需要分别下载视频和音频后合并
-                video_temp = repo_path / f"{title}_video.mp4"
-                audio_temp = repo_path / f"{title}_audio.m4a"
-                final_file = repo_path / f"{title}.mp4"
-
-                print("下载视频流...")
-                if not self.download_file(urls['video'], video_temp):
-                    return False
+                    return ('done', audio_file)
+                return None
 
-                print("下载音频流...")
-                if not self.download_file(urls['audio'], audio_temp):
-                    os.remove(video_temp)
-                    return False
+            # 如果没有单独音频流，下载视频后提取音频
+            if self.can_stream_ffmpeg():
+                print("边下载边提取音频...")
+                if self.stream_extract_audio(urls['video'], audio_file):
+                    print(f"✓ 音频提取完成")
+                    return ('done', audio_file)
+                print("流式提取失败，改为下载完整视频后提取")
+
+            video_file = repo_path / f"{title}_temp.mp4"
+            print("下载视频...")
+            if self.download_file(urls['video'], video_file):
+                return ('extract', video_file, audio_file)
+            return None
 
-                print("合并视频和音频...")
-                if self.merge_video_audio(video_temp, audio_temp, final_file):
-                    os.remove(video_temp)
-                    os.remove(audio_temp)
+        final_file = repo_path / f"{title}.mp4"
+        if urls['audio'] and urls['video']:
+            # DASH格式，需要分别下载视频和音频后合并
+            if self.can_stream_ffmpeg():
+                print("边下载边合并视频和音频...")
+                if self.stream_merge_video_audio(urls['video'], urls['audio'], final_file):
                     print(f"✓ 视频下载完成")
-                    return True
-                else:
-                    os.remove(video_temp)
-                    os.remove(audio_temp)
-            else:
-                # 传统格式，直接下载
-                video_file = repo_path / f"{title}.mp4"
-                print("下载视频...")
-                if self.download_file(urls['video'], video_file):
-                    print(f"✓ 视频下载完成")
-                    return True
+                    return ('done', final_file)
+                print("流式合并失败，改为分别下载后合并")
 
-        return False
+            video_temp = repo_path / f"{title}_video.mp4"
+            audio_temp = repo_path / f"{title}_audio.m4a"
 
-    def pull_repo(self, repo_name):
-        """同步仓库（类似git pull）"""
-        config = self.load_repo_config(repo_name)
+            # 视频流和音频流互不依赖，同时下载
+            print("下载视频流和音频流...")
+            if self.download_streams([(urls['video'], video_temp), (urls['audio'], audio_temp)]):
+                return ('merge', video_temp, audio_temp, final_file)
+            return None
+
+        # 传统格式，直接下载
+        print("下载视频...")
+        if self.download_file(urls['video'], final_file):
+            print(f"✓ 视频下载完成")
+            return ('done', final_file)
+        return None
+
+    def postprocess_media(self, post):
+        """后处理阶段：运行ffmpeg生成最终文件并删除临时文件"""
+        kind = post[0]
+        if kind == 'extract':
+            _, video_file, audio_file = post
+            print("提取音频...")
+            ok = self.extract_audio(video_file, audio_file)
+            os.remove(video_file)  # 删除临时视频文件
+            if ok:
+                print(f"✓ 音频提取完成")
+            return ok
+
+        if kind == 'merge':
+            _, video_temp, audio_temp, final_file = post
+            print("合并视频和音频...")
+            ok = self.merge_video_audio(video_temp, audio_temp, final_file)
+            os.remove(video_temp)
+            os.remove(audio_temp)
+            if ok:
+                print(f"✓ 视频下载完成")
+            return ok
+
+        return True
+
+    def record_video(self, repo_name, config, video):
+        """将下载完成的视频写入配置，并立即提交到仓库存储"""
+        info = {
+            'title': video['title'],
+            'upper': video['upper'],
+            'duration': video['duration'],
+            'pubdate': video['pubdate'],
+            'fav_time': video.get('fav_time'),
+            'cid': video.get('cid'),
+            'download_time': datetime.now().isoformat()
+        }
+        with self._lock:
+            config['video_list'][video['bvid']] = info
+        self.get_repo_store(repo_name).add_video(video['bvid'], info)
+
+    def set_pool_size(self, size, api_size=None):
+        """扩大CDN（及API）连接池，保证并发请求不会丢弃连接"""
+        self.session.set_pool_size(api=api_size, cdn=size)
+
+    def download_videos(self, videos, repo_name, config, workers=1, journal=None):
+        """通过分阶段流水线下载视频列表，workers为同时传输的视频数，返回成功数量"""
+        if workers > 1:
+            print(f"\n使用 {workers} 个线程并发下载, {self.post_workers} 个线程合并")
+            self.set_pool_size(workers * 2 * self.segments)
+
+        return PullPipeline(self, repo_name, config, workers, journal=journal).run(videos)
+
+    def full_sync_due(self, config):
+        """增量模式下是否需要进行一次完整同步（用于发现被移除的视频）"""
+        last_full_sync = config.get('last_full_sync')
+        if not last_full_sync:
+            return True
+        elapsed = datetime.now() - datetime.fromisoformat(last_full_sync)
+        return elapsed.total_seconds() >= self.full_sync_interval
+
+    def pull_repo(self, repo_name, workers=1, incremental=False, stats=None, resume=False):
+        """同步仓库（类似git pull），workers为并发下载数
+
+        incremental为True时只获取收藏夹头部的新增视频，不处理删除；
+        距离上次完整同步超过full_sync_interval时仍会进行完整同步。
+        resume为True时继续上次被中断的同步，沿用同步日志中的收藏夹列表。
+        传入stats字典时会填入下载、失败、删除数量
+        """
+        stats = {} if stats is None else stats
+        metrics = SyncMetrics(repo_name)
+        with metrics.active(), self.progress.running():
+            ok = self._pull_repo(repo_name, workers, incremental, stats, resume)
+        self.save_pull_metrics(repo_name, metrics, ok, stats)
+        return ok
+
+    def _pull_repo(self, repo_name, workers, incremental, stats, resume=False):
+        metrics = SyncMetrics.current()
+        config = self.start_pull(repo_name)
         if not config:
-            print(f"仓库 '{repo_name}' 不存在，请先使用 init 命令初始化")
             return False
 
-        print(f"正在同步仓库: {repo_name}")
-        print(f"收藏夹: {config['fav_title']}")
-
         fid = config['fid']
-        repo_path = self.get_repo_path(repo_name)
-
-        # 获取当前收藏夹视频列表
-        current_videos = self.get_favorite_videos(fid)
-        if not current_videos:
-            print("获取收藏夹视频列表失败")
+        journal = self.get_sync_journal(repo_name)
+        listing = {'complete': True}
+        resumed = self.resume_listing(journal, resume)
+        if resumed is not None and resumed[2]:
+            current_videos, full_sync, _ = resumed
+        else:
+            full_sync = not incremental or self.full_sync_due(config)
+            if full_sync:
+                # 逐页获取收藏夹列表，新视频在获取后续页的同时开始下载
+                current_videos = self.iter_favorite_videos(fid, status=listing)
+            else:
+                with metrics.phase('listing'):
+                    print("增量同步: 只获取新增视频")
+                    result = self.get_new_favorite_videos(fid, config['video_list'])
+                if result is None:
+                    print("获取收藏夹视频列表失败")
+                    return False
+                current_videos, full_sync = result
+            journal.begin(full_sync)
+            if resumed is not None:
+                # 先继续上次已列出但未完成的视频，再处理重新获取的列表
+                current_videos = itertools.chain(resumed[0], current_videos)
+
+        # 下载新视频，每个视频完成后立即提交（listing阶段的耗时在下载过程中单独计入）
+        plan = PullPlan(self, repo_name, config, full_sync, journal=None if resumed and resumed[2] else journal)
+        with metrics.phase('download'):
+            downloaded_count = self.download_videos(plan.filter(current_videos, listing), repo_name, config, workers,
+                                                    journal)
+        if plan.to_delete is None:
             return False
 
-        # 创建当前视频的bvid集合
-        current_bvids = {video['bvid'] for video in current_videos}
-        local_bvids = set(config['video_list'].keys())
+        # 列表获取完整后才删除云端已移除的视频；不完整时不删除，也不记为完整同步
+        deleted_count = 0
+        if plan.complete:
+            with metrics.phase('delete'):
+                journal.plan_deletes(plan.to_delete)
+                deleted_count = self.delete_local_videos(repo_name, config, plan.to_delete)
+
+        with metrics.phase('finish'):
+            self.finish_pull(repo_name, config, full_sync and plan.complete, downloaded_count, deleted_count)
+            journal.finish()
+        stats.update(self.make_pull_stats(config, plan.download_count, downloaded_count, deleted_count, plan.complete))
+        return True
 
-        # 找出需要删除的视频（本地有但云端没有）
-        to_delete = local_bvids - current_bvids
-        # 找出需要下载的视频（云端有但本地没有）
-        to_download = current_bvids - local_bvids
+    def resume_listing(self, journal, resume):
+        """继续上次未完成的同步，返回 (视频列表, 是否完整同步, 列表是否完整)，不能继续时返回None
 
-        print(f"本地视频: {len(local_bvids)} 个")
-        print(f"云端视频: {len(current_bvids)} 个")
-        print(f"需要删除: {len(to_delete)} 个")
-        print(f"需要下载: {len(to_download)} 个")
+        列表完整时返回整个列表，不再重新获取；不完整时只返回已列出但未完成的视频，由调用方接上重新获取的列表
+        """
+        if not resume:
+            if journal.unfinished():
+                print("上次同步未完成，可使用 pull --resume 继续")
+            return None
 
-        # 删除本地多余的文件
+        if not journal.unfinished():
+            print("没有未完成的同步，进行正常同步")
+            return None
+        if not journal.resumable(self.resume_max_age):
+            print("上次同步的记录已过期，重新获取列表（已完成的视频不会重复下载）")
+            return None
+
+        state = journal.state()
+        counts = journal.counts()
+        done = counts.get('done', 0)
+        remaining = sum(counts.values()) - done
+        print(f"继续上次的同步: 已完成 {done} 个, 未完成 {remaining} 个")
+        if state.get('listing_complete'):
+            print(f"沿用 {(time.time() - state['listed_at']) / 60:.0f} 分钟前获取的收藏夹列表")
+            return journal.listed_videos(), state['full_sync'], True
+        print("上次的列表未获取完整，先下载未完成的视频，同时重新获取列表")
+        return journal.pending_videos(), state['full_sync'], False
+
+    METRICS_FILE = ".bili_pull_metrics.json"
+
+    def save_pull_metrics(self, repo_name, metrics, ok, stats):
+        """将本次同步的指标写入仓库目录下的JSON文件，设置了prometheus_path时同时更新Prometheus文本文件"""
+        if not self.repo_exists(repo_name):
+            return None
+
+        summary = metrics.summary(ok, stats)
+        try:
+            path = self.get_repo_path(repo_name) / self.METRICS_FILE
+            tmp_path = path.with_name(path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+
+            if self.prometheus_path:
+                with self._lock:
+                    self._prometheus_summaries[repo_name] = summary
+                    prometheus_path = Path(self.prometheus_path)
+                    tmp_path = prometheus_path.with_name(prometheus_path.name + '.tmp')
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(SyncMetrics.to_prometheus(self._prometheus_summaries))
+                    os.replace(tmp_path, prometheus_path)
+        except Exception as e:
+            print(f"保存同步指标失败: {e}")
+        return summary
+
+    def make_pull_stats(self, config, download_count, downloaded_count, deleted_count, complete=True):
+        """单个仓库的同步结果统计，download_count为需要下载的视频数，complete为收藏夹列表是否获取完整"""
+        return {
+            'downloaded': downloaded_count,
+            'failed': download_count - downloaded_count,
+            'deleted': deleted_count,
+            'total': len(config['video_list']),
+            'incomplete': not complete
+        }
+
+    def resolve_repo_names(self, repo_inputs=None, unresolved=None):
+        """将仓库ID或名称列表解析为仓库名，为空时返回全部仓库（按ID排序）
+
+        传入unresolved列表时，找不到对应仓库的输入会追加到其中
+        """
+        if not repo_inputs:
+            entries = self.index.entries()
+            return sorted(entries, key=lambda name: (entries[name].get('repo_id') or 0, name))
+
+        repo_names = []
+        for user_input in repo_inputs:
+            repo_name = self.parse_repo_input(user_input)
+            if not repo_name:
+                if unresolved is not None:
+                    unresolved.append(user_input)
+            elif repo_name not in repo_names:
+                repo_names.append(repo_name)
+        return repo_names
+
+    def pull_all(self, repo_names=None, parallel=2, workers=1, incremental=False, resume=False):
+        """同时同步多个仓库（默认全部），共用API限速器和传输名额；单个仓库失败不影响其他仓库
+
+        返回 {仓库名: 结果统计}，结果中ok表示该仓库是否同步成功
+        """
+        if repo_names is None:
+            repo_names = self.resolve_repo_names()
+        if not repo_names:
+            print("没有需要同步的仓库")
+            return {}
+
+        def run(repo_name):
+            stats = {}
+            start = time.time()
+            try:
+                ok = self.pull_repo(repo_name, workers=workers, incremental=incremental, stats=stats, resume=resume)
+                error = None if ok else '同步失败'
+            except Exception as e:
+                print(f"同步仓库出错 {repo_name}: {e}")
+                ok, error = False, str(e)
+            stats.update({'ok': ok, 'error': error, 'elapsed': time.time() - start})
+            return stats
+
+        print(f"开始同步 {len(repo_names)} 个仓库，同时同步 {parallel} 个")
+        self.set_pool_size(parallel * workers * 2 * self.segments, api_size=parallel * 8)
+        results = {}
+        with self.progress.running(), ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+            futures = {executor.submit(run, repo_name): repo_name for repo_name in repo_names}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+        self.print_pull_summary(repo_names, results)
+        return results
+
+    def print_pull_summary(self, repo_names, results):
+        """输出多仓库同步的汇总"""
+        print(f"\n{'=' * 80}")
+        print("同步汇总:")
+        for repo_name in repo_names:
+            result = results.get(repo_name, {'ok': False, 'error': '未执行'})
+            if result['ok']:
+                mark = '!' if result.get('failed') or result.get('incomplete') else '✓'
+                note = ", 列表不完整" if result.get('incomplete') else ""
+                print(f"{mark} {repo_name}: 下载 {result['downloaded']}, 失败 {result['failed']}, "
+                      f"删除 {result['deleted']}, 共 {result['total']} 个{note} ({result['elapsed']:.1f}s)")
+            else:
+                print(f"✗ {repo_name}: {result['error']}")
+
+    def start_pull(self, repo_name):
+        """加载要同步的仓库配置，仓库不存在时返回None"""
+        config = self.load_repo_config(repo_name)
+        if not config:
+            print(f"仓库 '{repo_name}' 不存在，请先使用 init 命令初始化")
+            return None
+
+        print(f"正在同步仓库: {repo_name}")
+        print(f"收藏夹: {config['fav_title']}")
+        return config
+
+    def delete_local_videos(self, repo_name, config, to_delete):
+        """删除本地多余的文件和记录，返回删除的文件数"""
+        repo_path = self.get_repo_path(repo_name)
         deleted_count = 0
         for bvid in to_delete:
             video_info = config['video_list'][bvid]
@@ -473,9 +1446,9 @@ class FavRepository:
             extension = '.m4a' if config['audio_only'] else '.mp4'
             file_path = repo_path / f"{title}{extension}"
 
-            if file_path.exists():
+            if file_path.exists() or file_path.is_symlink():
                 try:
-                    os.remove(file_path)
+                    self.remove_media_file(file_path)
                     print(f"✗ 已删除: {title}")
                     deleted_count += 1
                 except Exception as e:
@@ -483,40 +1456,24 @@ class FavRepository:
 
             # 从配置中移除
             del config['video_list'][bvid]
+        self.get_repo_store(repo_name).remove_videos(to_delete)
+        return deleted_count
 
-        # 下载新视频
-        downloaded_count = 0
-        videos_to_download = [v for v in current_videos if v['bvid'] in to_download]
-
-        for i, video in enumerate(videos_to_download, 1):
-            print(f"\n[{i}/{len(videos_to_download)}] ", end='')
-
-            if self.download_video(video, repo_path, config['quality'], config['audio_only']):
-                # 添加到配置
-                config['video_list'][video['bvid']] = {
-                    'title': video['title'],
-                    'upper': video['upper'],
-                    'duration': video['duration'],
-                    'pubdate': video['pubdate'],
-                    'download_time': datetime.now().isoformat()
-                }
-                downloaded_count += 1
-            else:
-                print("✗ 下载失败")
-
-            # 休息一下避免请求过快
-            time.sleep(1)
-
-        # 更新配置
+    def finish_pull(self, repo_name, config, full_sync, downloaded_count, deleted_count):
+        """保存同步时间、更新索引并输出同步结果"""
         config['last_sync'] = datetime.now().isoformat()
-        self.save_repo_config(repo_name, config)
+        if full_sync:
+            config['last_full_sync'] = config['last_sync']
+        self.get_repo_store(repo_name).save_meta(config)
+        self.index.update(repo_name, config, len(config['video_list']))
 
         print(f"\n同步完成！")
         print(f"✓ 下载: {downloaded_count} 个")
         print(f"✗ 删除: {deleted_count} 个")
         print(f"📁 当前仓库共有: {len(config['video_list'])} 个文件")
-
-        return True
+        stats = self.cache.stats()
+        if stats['hits'] or stats['misses']:
+            print(f"API缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次")
 
     def update_repo_config(self, repo_name, quality=None, audio_only=None):
         """更新仓库配置"""
@@ -553,20 +1510,26 @@ class FavRepository:
         if audio_only is not None and audio_only != old_audio_only:
             print(f"\n注意: 下载模式已改变，建议:")
             if audio_only:
-                print("- 删除现有视频文件，重新下载音频")
+                print("- 从现有视频文件中提取音频（本地转换，不重新下载）")
                 print("- 或保留视频文件，新视频将下载为音频")
-            else:
-                print("- 删除现有音频文件，重新下载视频")
-                print("- 或保留音频文件，新视频将下载为视频")
 
+                choice = input("是否将现有视频转换为音频? (y/n, 默认n): ").strip().lower()
+                if choice == 'y':
+                    return self.convert_repo_to_audio(repo_name, config)
+                return True
+
+            print("- 删除现有音频文件，重新下载视频")
+            print("- 或保留音频文件，新视频将下载为视频")
+
+            # 音频无法转换为视频，只能重新下载
             choice = input("是否重新下载所有文件? (y/n, 默认n): ").strip().lower()
             if choice == 'y':
                 # 清空本地文件和记录
                 print("正在清理旧文件...")
                 for file_path in repo_path.iterdir():
-                    if file_path.suffix in ['.mp4', '.m4a', '.mp3'] and file_path.name != '.bili_repo.json':
+                    if file_path.suffix in ['.mp4', '.m4a', '.mp3']:
                         try:
-                            os.remove(file_path)
+                            self.remove_media_file(file_path)
                             print(f"已删除: {file_path.name}")
                         except Exception as e:
                             print(f"删除失败 {file_path.name}: {e}")
@@ -577,9 +1540,101 @@ class FavRepository:
 
                 print("开始重新下载...")
                 return self.pull_repo(repo_name)
+            return True
+
+        # 视频模式下提高清晰度：本地文件无法转换为更高清晰度，只能重新下载
+        if not config['audio_only'] and quality is not None and quality > old_quality and config['video_list']:
+            print(f"\n注意: 清晰度已提高，现有 {len(config['video_list'])} 个视频仍为原清晰度")
+            print("- 重新下载现有视频（新文件下载完成后替换旧文件）")
+            print("- 或保留现有视频，只有新视频使用新清晰度")
+
+            choice = input("是否以新清晰度重新下载现有视频? (y/n, 默认n): ").strip().lower()
+            if choice == 'y':
+                self.requeue_videos(repo_name, config, list(config['video_list']))
+                print("开始重新下载...")
+                return self.pull_repo(repo_name)
+
+        return True
+
+    def requeue_videos(self, repo_name, config, bvids):
+        """将视频移出记录，下次同步时作为新视频重新下载
 
+        本地文件不删除，新文件下载完成时替换；同时强制下次进行完整同步，增量同步也能找回这些视频
+        """
+        for bvid in bvids:
+            del config['video_list'][bvid]
+        store = self.get_repo_store(repo_name)
+        store.remove_videos(bvids)
+        config['last_full_sync'] = None
+        store.save_meta(config)
+        self.index.update(repo_name, config, len(config['video_list']))
+
+    def convert_repo_to_audio(self, repo_name, config, workers=None):
+        """视频仓库改为仅音频后，从本地视频文件提取音频（只复制音频流，不访问网络）
+
+        多个ffmpeg进程并行转换，workers默认为CPU核数；缺少视频文件或提取失败的视频
+        从记录中移除，随后的同步只重新下载这些视频
+        """
+        repo_path = self.get_repo_path(repo_name)
+        videos = list(config['video_list'].items())
+        workers = workers or max(self.post_workers, os.cpu_count() or 1)
+        print(f"\n正在转换 {len(videos)} 个视频, {workers} 个ffmpeg进程...")
+
+        def convert(item):
+            bvid, info = item
+            try:
+                return self.convert_video_to_audio(bvid, info['title'], repo_path)
+            except Exception as e:
+                print(f"转换出错 {info['title']}: {e}")
+                return False
+
+        start = time.time()
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for index, ((bvid, info), ok) in enumerate(zip(videos, executor.map(convert, videos)), 1):
+                if ok:
+                    print(f"[{index}/{len(videos)}] ✓ 已转换: {info['title']}")
+                else:
+                    print(f"[{index}/{len(videos)}] ✗ 无法转换: {info['title']}")
+                    failed.append(bvid)
+
+        # 无法转换的视频移出记录，同步时作为新视频下载
+        for bvid in failed:
+            del config['video_list'][bvid]
+        self.get_repo_store(repo_name).remove_videos(failed)
+        self.index.update(repo_name, config, len(config['video_list']))
+
+        print(f"\n转换完成: {len(videos) - len(failed)} 个, 需要重新下载: {len(failed)} 个 "
+              f"({time.time() - start:.1f}s)")
+        if failed:
+            print("开始下载无法转换的视频...")
+            return self.pull_repo(repo_name)
+        return True
+
+    def convert_video_to_audio(self, bvid, title, repo_path):
+        """将仓库中的一个视频文件转换为音频文件并删除视频文件，返回是否成功"""
+        video_file = repo_path / f"{title}.mp4"
+        audio_file = repo_path / f"{title}.m4a"
+
+        if self.media_store:
+            # 仅音频对象与清晰度无关，其他仓库已有时直接链接
+            key = self.media_store.object_key(bvid, None, True)
+            with self.object_lock(key):
+                if not self.media_store.has(key, '.m4a'):
+                    if not video_file.exists() or not self.extract_audio(
+                            video_file, self.media_store.object_path(key, '.m4a')):
+                        return False
+                self.media_store.link(key, '.m4a', audio_file)
+        elif not video_file.exists() or not self.extract_audio(video_file, audio_file):
+            return False
+
+        self.remove_media_file(video_file)
         return True
 
+    def verify_repo(self, repo_name, deep=False, repair=True):
+        """检查仓库文件的完整性，缺失或损坏的视频在下次同步时重新下载，返回统计，仓库不存在时返回None"""
+        return RepoVerifier(self).verify(repo_name, deep, repair)
+
     def parse_repo_input(self, user_input):
         """解析用户输入的仓库标识（ID或名称）"""
         user_input = user_input.strip()
@@ -595,7 +1650,7 @@ class FavRepository:
                 return None
         except ValueError:
             # 不是数字，当作仓库名处理
-            if self.load_repo_config(user_input):
+            if user_input in self.index.entries() or self.repo_exists(user_input):
                 return user_input
             else:
                 print(f"未找到名为 '{user_input}' 的仓库")
@@ -603,33 +1658,21 @@ class FavRepository:
 
     def list_repos(self):
         """列出所有仓库"""
-        repos = []
-        for item in self.base_dir.iterdir():
-            if item.is_dir():
-                config_path = item / ".bili_repo.json"
-                if config_path.exists():
-                    config = self.load_repo_config(item.name)
-                    if config:
-                        repos.append({
-                            'name': item.name,
-                            'config': config
-                        })
-
-        if not repos:
+        entries = self.index.entries()
+        if not entries:
             print("没有找到任何仓库")
             return
 
         print("现有仓库列表:")
         print("=" * 80)
-        for repo in repos:
-            config = repo['config']
-            repo_id = config.get('repo_id', '未知')
-            print(f"📁 [{repo_id}] {repo['name']}")
-            print(f"   收藏夹: {config['fav_title']}")
-            print(f"   UP主: {config['fav_upper']}")
-            print(f"   模式: {'仅音频' if config['audio_only'] else '视频'}")
-            quality_desc = self.quality_map.get(config['quality'], f"未知({config['quality']})")
+        for name, entry in sorted(entries.items(), key=lambda item: (item[1].get('repo_id') or 0, item[0])):
+            repo_id = entry.get('repo_id') or '未知'
+            print(f"📁 [{repo_id}] {name}")
+            print(f"   收藏夹: {entry['fav_title']}")
+            print(f"   UP主: {entry['fav_upper']}")
+            print(f"   模式: {'仅音频' if entry['audio_only'] else '视频'}")
+            quality_desc = self.quality_map.get(entry['quality'], f"未知({entry['quality']})")
             print(f"   清晰度: {quality_desc}")
-            print(f"   视频数量: {len(config['video_list'])}")
-            print(f"   最后同步: {config['last_sync'] or '从未同步'}")
-            print()
\ No newline at end of file
+            print(f"   视频数量: {entry['video_count']}")
+            print(f"   最后同步: {entry['last_sync'] or '从未同步'}")
+            print()
@@ -0,0 +1,98 @@
+import socket
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+
+class HttpTransport(requests.Session):
+    """所有同步HTTP请求共用的会话
+
+    API和CDN使用各自的连接池，CDN的大量连接不会挤掉API的空闲连接；连接池用满时等待空闲连接，不额外新建；
+    幂等的GET/HEAD请求在连接失败、等待响应超时和5xx响应时自动重试；
+    所有请求都有连接超时和读取超时，卡住的连接不会让同步永远挂起
+    """
+
+    API_PREFIX = "https://api.bilibili.com"
+
+    # 自动重试的HTTP状态码（风控的412/429由限速器处理，不在此重试）
+    RETRY_STATUS = (500, 502, 503, 504)
+
+    def __init__(self, api_pool_size=10, cdn_pool_size=10, retries=3, backoff=0.5,
+                 connect_timeout=10, read_timeout=30, keep_alive=True):
+        super().__init__()
+        self.retries = retries
+        self.backoff = backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # 保持连接时开启TCP keepalive，及时发现长时间空闲后已断开的连接；关闭时每个请求使用新连接
+        self.keep_alive = keep_alive
+        self.socket_options = list(HTTPConnection.default_socket_options)
+        if keep_alive:
+            self.socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        else:
+            self.headers['Connection'] = 'close'
+
+        self.api_prefixes = [self.API_PREFIX]
+        self.api_pool_size = 0
+        self.cdn_pool_size = 0
+        self.set_pool_size(api_pool_size, cdn_pool_size)
+
+    def make_adapter(self, pool_size, host_count):
+        """每个主机最多保留pool_size个连接，最多缓存host_count个主机的连接池"""
+        retry = Retry(total=self.retries, connect=self.retries, read=self.retries, status=self.retries,
+                      backoff_factor=self.backoff, status_forcelist=self.RETRY_STATUS,
+                      allowed_methods=frozenset(['GET', 'HEAD']), raise_on_status=False)
+        return _TimeoutHTTPAdapter((self.connect_timeout, self.read_timeout), self.socket_options,
+                                   pool_connections=host_count, pool_maxsize=pool_size, pool_block=True,
+                                   max_retries=retry)
+
+    def set_pool_size(self, api=None, cdn=None):
+        """扩大API或CDN的连接池（每个主机的连接数），只增不减"""
+        if api and api > self.api_pool_size:
+            self.api_pool_size = api
+            self.mount_api_adapter()
+
+        if cdn and cdn > self.cdn_pool_size:
+            self.cdn_pool_size = cdn
+            # 下载链接分布在多个CDN主机和备用镜像上
+            adapter = self.make_adapter(cdn, 32)
+            self.mount('https://', adapter)
+            self.mount('http://', adapter)
+
+    def mount_api_adapter(self):
+        adapter = self.make_adapter(self.api_pool_size, len(self.api_prefixes))
+        for prefix in self.api_prefixes:
+            self.mount(prefix, adapter)
+
+    def add_api_prefix(self, prefix):
+        """使用其他API地址（如benchmark.py的模拟服务）时，该地址下的请求也使用API连接池
+
+        按最长前缀选择连接池，API与CDN在同一主机上时传入API路径的前缀即可区分
+        """
+        if any(prefix.lower().startswith(known.lower()) for known in self.api_prefixes):
+            return
+        self.api_prefixes.append(prefix)
+        self.mount_api_adapter()
+
+    def backoff_delay(self, retry):
+        """第retry次重试前的等待秒数"""
+        return self.backoff * (2 ** retry)
+
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """未指定timeout的请求使用默认的连接和读取超时"""
+
+    def __init__(self, timeout, socket_options, **kwargs):
+        self.timeout = timeout
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
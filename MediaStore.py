@@ -0,0 +1,195 @@
+import errno
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class MediaStore:
+    """基础目录下的共享媒体存储，同一视频只下载一次，以链接的方式放入各个仓库
+
+    对象按bvid、下载模式和清晰度命名，引用记录保存在refs.db中，
+    最后一个引用被删除时才删除对象文件。引用路径和符号链接都相对于基础目录，
+    整个基础目录移动或恢复备份到其他位置后仍然有效
+    """
+
+    DIR_NAME = ".bili_objects"
+
+    # Linux上的FICLONE ioctl，用于reflink
+    FICLONE = 0x40049409
+
+    # 表示当前文件系统不支持该链接方式的错误，只有这些错误才改用下一种方式，其他错误（如对象不存在）直接抛出
+    LINK_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP}
+    REFLINK_UNSUPPORTED = LINK_UNSUPPORTED | {errno.EINVAL, errno.ENOTTY}
+
+    def __init__(self, base_dir):
+        self.base_dir = Path(base_dir)
+        self.root = self.base_dir / self.DIR_NAME
+        self.root.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(str(self.root / "refs.db"), check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS refs (
+                path TEXT PRIMARY KEY,
+                object TEXT NOT NULL,
+                link_type TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_refs_object ON refs (object)')
+        self.conn.commit()
+        self.migrate_absolute_refs()
+
+    def ref_key(self, path):
+        """引用记录中的路径：相对于基础目录的 仓库名/文件名"""
+        path = Path(os.path.abspath(path))
+        try:
+            return path.relative_to(os.path.abspath(self.base_dir)).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def migrate_absolute_refs(self):
+        """将旧版本以绝对路径保存的引用改为相对路径，并把指向绝对路径的符号链接改为相对链接
+
+        仓库都在基础目录下一级，绝对路径的最后两段就是 仓库名/文件名，基础目录移动过也能对应上
+        """
+        with self._lock, self.conn:
+            rows = self.conn.execute('SELECT path, object, link_type FROM refs').fetchall()
+            for path, obj, link_type in rows:
+                if not os.path.isabs(path):
+                    continue
+                parts = Path(path).parts
+                key = '/'.join(parts[-2:])
+                self.conn.execute('DELETE FROM refs WHERE path = ?', (path,))
+                self.conn.execute('INSERT OR REPLACE INTO refs (path, object, link_type) VALUES (?, ?, ?)',
+                                  (key, obj, link_type))
+                dest = self.base_dir / key
+                if link_type == 'symlink' and dest.is_symlink() and os.path.isabs(os.readlink(dest)):
+                    try:
+                        dest.unlink()
+                        os.symlink(self.symlink_target(self.root / obj, dest), dest)
+                    except OSError as e:
+                        print(f"修复符号链接失败 {key}: {e}")
+
+    @staticmethod
+    def symlink_target(source, dest):
+        """符号链接使用相对路径，基础目录整体移动后仍然有效"""
+        return os.path.relpath(os.path.abspath(source), os.path.dirname(os.path.abspath(dest)))
+
+    @classmethod
+    def exists(cls, base_dir):
+        return (Path(base_dir) / cls.DIR_NAME).is_dir()
+
+    def object_key(self, bvid, quality, audio_only):
+        """对象名：音频流与所选清晰度无关，因此仅音频模式的对象在不同清晰度的仓库间共享"""
+        if audio_only:
+            return f"{bvid}-audio"
+        return f"{bvid}-video-{quality}"
+
+    def object_path(self, key, extension):
+        return self.root / f"{key}{extension}"
+
+    def has(self, key, extension):
+        return self.object_path(key, extension).exists()
+
+    def link(self, key, extension, dest):
+        """将对象放入仓库：优先硬链接，其次reflink，最后符号链接。返回使用的链接方式，对象不存在时抛出FileNotFoundError
+
+        检查对象、创建链接和写入引用都在锁内完成，同时进行的release或discard不会在中途删除对象
+        """
+        source = self.object_path(key, extension)
+        dest = Path(dest)
+        with self._lock, self.conn:
+            if not source.exists():
+                raise FileNotFoundError(errno.ENOENT, "共享对象不存在", str(source))
+            if dest.exists() or dest.is_symlink():
+                dest.unlink()
+
+            link_type = self._make_link(source, dest)
+            key = self.ref_key(dest)
+            row = self.conn.execute('SELECT object FROM refs WHERE path = ?', (key,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO refs (path, object, link_type) VALUES (?, ?, ?)',
+                              (key, source.name, link_type))
+            # 替换了指向其他对象的链接（如提高清晰度后重新下载），旧对象没有其他引用时一并删除
+            if row is not None and row[0] != source.name:
+                self._remove_unreferenced(row[0])
+        return link_type
+
+    def _remove_unreferenced(self, name):
+        remaining = self.conn.execute('SELECT COUNT(*) FROM refs WHERE object = ?', (name,)).fetchone()[0]
+        if remaining == 0:
+            obj = self.root / name
+            if obj.exists():
+                obj.unlink()
+
+    def _make_link(self, source, dest):
+        try:
+            os.link(source, dest)
+            return 'hardlink'
+        except OSError as e:
+            if e.errno not in self.LINK_UNSUPPORTED:
+                raise
+
+        if fcntl is not None:
+            try:
+                with open(source, 'rb') as src, open(dest, 'wb') as dst:
+                    fcntl.ioctl(dst.fileno(), self.FICLONE, src.fileno())
+                return 'reflink'
+            except OSError as e:
+                if dest.exists():
+                    dest.unlink()
+                if e.errno not in self.REFLINK_UNSUPPORTED:
+                    raise
+
+        os.symlink(self.symlink_target(source, dest), dest)
+        return 'symlink'
+
+    def release(self, path):
+        """删除仓库中的链接，对象没有其他引用时一并删除。返回是否删除了一个受管理的链接"""
+        path = Path(path)
+        key = self.ref_key(path)
+        with self._lock, self.conn:
+            row = self.conn.execute('SELECT object FROM refs WHERE path = ?', (key,)).fetchone()
+            if row is None:
+                return False
+
+            self.conn.execute('DELETE FROM refs WHERE path = ?', (key,))
+            if path.exists() or path.is_symlink():
+                path.unlink()
+
+            self._remove_unreferenced(row[0])
+        return True
+
+    def object_of(self, path):
+        """仓库中的文件链接到的对象名，不是受管理的链接时返回None"""
+        with self._lock:
+            row = self.conn.execute('SELECT object FROM refs WHERE path = ?', (self.ref_key(path),)).fetchone()
+        return row[0] if row else None
+
+    def discard(self, name):
+        """对象损坏时删除对象以及所有仓库中指向它的链接，返回被删除链接的引用路径（仓库名/文件名）"""
+        with self._lock, self.conn:
+            keys = [row[0] for row in self.conn.execute('SELECT path FROM refs WHERE object = ?', (name,))]
+            self.conn.execute('DELETE FROM refs WHERE object = ?', (name,))
+            for key in keys:
+                path = self.base_dir / key
+                if path.exists() or path.is_symlink():
+                    path.unlink()
+            obj = self.root / name
+            if obj.exists():
+                obj.unlink()
+        return keys
+
+    def ref_count(self, key, extension):
+        name = self.object_path(key, extension).name
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM refs WHERE object = ?', (name,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,113 @@
+import statistics
+import threading
+from urllib.parse import urlparse
+
+
+class MirrorSelector:
+    """在同一个流的多个CDN链接（主链接和备用镜像）中选择最快的主机
+
+    每个主机记录探测到的首字节时间和实际传输速度，在本次运行中一直有效：
+    已测过的主机不再重复探测，之后的下载直接按记录排序
+    """
+
+    def __init__(self, reference_size=4 * 1024 * 1024, switch_ratio=3.0, min_speed=32 * 1024, window=2.0,
+                 probe_size=256 * 1024):
+        # 按“首字节时间 + 传输reference_size字节所需时间”比较主机
+        self.reference_size = reference_size
+        # 传输中的速度低于已知最快速度的1/switch_ratio，或低于min_speed（字节/秒）时换用其他镜像
+        self.switch_ratio = switch_ratio
+        self.min_speed = min_speed
+        # 传输中每隔window秒检查一次速度
+        self.window = window
+        # 探测请求读取的字节数，用于粗略估计各主机的速度
+        self.probe_size = probe_size
+
+        self._lock = threading.Lock()
+        # {主机: {'ttfb': 秒, 'speed': 字节/秒, 'failures': 连续失败次数}}
+        self.hosts = {}
+
+    @staticmethod
+    def host(url):
+        return urlparse(url).netloc
+
+    @staticmethod
+    def candidates(urls):
+        """将单个链接或链接列表转换为去重后的列表"""
+        if isinstance(urls, str):
+            return [urls]
+        return list(dict.fromkeys(url for url in urls if url))
+
+    def _entry(self, host):
+        return self.hosts.setdefault(host, {'ttfb': None, 'speed': None, 'failures': 0})
+
+    def unprobed(self, urls):
+        """返回主机尚未测速的链接，每个主机一个"""
+        result = {}
+        with self._lock:
+            for url in urls:
+                host = self.host(url)
+                if host not in self.hosts and host not in result:
+                    result[host] = url
+        return list(result.values())
+
+    def record_probe(self, url, ttfb, nbytes=0, seconds=0.0):
+        """记录探测请求的首字节时间和读取nbytes字节的耗时，ttfb为None表示探测失败"""
+        with self._lock:
+            entry = self._entry(self.host(url))
+            if ttfb is None:
+                entry['failures'] += 1
+                return
+            entry['ttfb'] = ttfb
+            # 探测的数据量小，只在还没有实际传输速度时作为估计
+            if entry['speed'] is None and nbytes and seconds > 0:
+                entry['speed'] = nbytes / seconds
+
+    def record_transfer(self, url, nbytes, seconds):
+        """记录一次传输的速度，太小的传输主要反映延迟，不计入"""
+        if nbytes < 256 * 1024 or seconds <= 0:
+            return
+        speed = nbytes / seconds
+        with self._lock:
+            entry = self._entry(self.host(url))
+            entry['speed'] = speed if entry['speed'] is None else entry['speed'] * 0.7 + speed * 0.3
+            entry['failures'] = 0
+
+    def record_failure(self, url):
+        with self._lock:
+            self._entry(self.host(url))['failures'] += 1
+
+    def rank(self, urls):
+        """按预计耗时排序，失败过的主机排在最后；未测过的主机按已测主机的中位数估计，
+        排在明显更快的已测主机之后，相同时保持接口给出的顺序"""
+        with self._lock:
+            speeds = [entry['speed'] for entry in self.hosts.values() if entry['speed']]
+            ttfbs = [entry['ttfb'] for entry in self.hosts.values() if entry['ttfb'] is not None]
+            typical_speed = statistics.median(speeds) if speeds else None
+            typical_ttfb = statistics.median(ttfbs) if ttfbs else 0.0
+
+            def cost(url):
+                entry = self.hosts.get(self.host(url)) or {'ttfb': None, 'speed': None, 'failures': 0}
+                speed = entry['speed'] or typical_speed
+                ttfb = typical_ttfb if entry['ttfb'] is None else entry['ttfb']
+                transfer = self.reference_size / speed if speed else 0.0
+                # 预计耗时相同时已测过的主机优先
+                return (entry['failures'], ttfb + transfer, entry['speed'] is None)
+
+            return sorted(urls, key=cost)
+
+    def should_switch(self, url, speed, alternatives):
+        """传输速度为speed（字节/秒）时是否应换用alternatives中的其他镜像"""
+        if not alternatives:
+            return False
+        if speed < self.min_speed:
+            return True
+
+        current = self.host(url)
+        with self._lock:
+            known = [self.hosts[current]['speed']] if current in self.hosts else []
+            for other in alternatives:
+                entry = self.hosts.get(self.host(other))
+                if entry and not entry['failures'] and self.host(other) != current:
+                    known.append(entry['speed'])
+        known = [value for value in known if value]
+        return bool(known) and speed * self.switch_ratio < max(known)
@@ -0,0 +1,213 @@
+import shutil
+import sys
+import threading
+import time
+import unicodedata
+from collections import deque
+from contextlib import contextmanager
+
+
+class ProgressReporter:
+    """汇总所有进行中传输的进度显示，按固定间隔刷新而不是每个数据块输出一次
+
+    终端中在一行状态栏里显示各传输的进度、总速度和剩余时间；
+    输出被重定向或quiet为True时，只按summary_interval输出汇总行
+    """
+
+    def __init__(self, interval=0.5, summary_interval=10.0):
+        self.interval = interval
+        self.summary_interval = summary_interval
+        self.quiet = False
+
+        self._lock = threading.Lock()
+        # {传输ID: [名称, 总字节数, 已完成字节数]}
+        self._transfers = {}
+        self._next_id = 0
+        self._total_bytes = 0
+        self._completed = 0
+        # 最近几秒的 (时间, 累计字节数)，用于计算速度
+        self._samples = deque()
+
+        self._running = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._stdout = None
+        self._status_shown = False
+        # 其他输出是否停在行首，输出了半行时不显示状态栏
+        self._line_start = True
+        self._output_lock = threading.RLock()
+
+    def start(self, name, total=0, done=0):
+        """登记一个传输，返回传输ID"""
+        with self._lock:
+            transfer_id = self._next_id
+            self._next_id += 1
+            self._transfers[transfer_id] = [name, total, done]
+            return transfer_id
+
+    def update(self, transfer_id, nbytes):
+        with self._lock:
+            transfer = self._transfers.get(transfer_id)
+            if transfer is not None:
+                transfer[2] += nbytes
+            self._total_bytes += nbytes
+
+    def finish(self, transfer_id):
+        with self._lock:
+            if self._transfers.pop(transfer_id, None) is not None:
+                self._completed += 1
+
+    @contextmanager
+    def running(self):
+        """在此范围内定期刷新进度，可嵌套（多个仓库并发同步时共用一个显示）"""
+        with self._lock:
+            self._running += 1
+            first = self._running == 1
+        if first:
+            self._begin()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last:
+                self._end()
+
+    def _begin(self):
+        self._stdout = sys.stdout
+        self._tty = not self.quiet and hasattr(self._stdout, 'isatty') and self._stdout.isatty()
+        if self._tty:
+            # 其他输出写入前先清除状态栏，避免与状态栏混在同一行
+            sys.stdout = _StatusAwareStream(self._stdout, self)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _end(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._tty:
+            with self._output_lock:
+                self.clear_status()
+                if isinstance(sys.stdout, _StatusAwareStream):
+                    sys.stdout = self._stdout
+
+    def _run(self):
+        interval = self.interval if self._tty else self.summary_interval
+        last_bytes = None
+        while not self._stop.wait(interval):
+            snapshot = self.snapshot()
+            if self._tty:
+                self.show_status(self.format_status(snapshot))
+            elif snapshot['active'] or snapshot['bytes'] != last_bytes:
+                # 非终端输出：只在有传输活动时输出汇总行
+                self._stdout.write(self.format_summary(snapshot) + '\n')
+                self._stdout.flush()
+            last_bytes = snapshot['bytes']
+
+    def snapshot(self):
+        """当前进度：进行中的传输、累计字节数、速度（字节/秒）和剩余秒数"""
+        now = time.time()
+        with self._lock:
+            transfers = [tuple(transfer) for transfer in self._transfers.values()]
+            total_bytes = self._total_bytes
+            completed = self._completed
+            self._samples.append((now, total_bytes))
+            while len(self._samples) > 2 and now - self._samples[0][0] > 5:
+                self._samples.popleft()
+            first_time, first_bytes = self._samples[0]
+
+        elapsed = now - first_time
+        speed = (total_bytes - first_bytes) / elapsed if elapsed > 0 else 0.0
+        remaining = sum(total - done for _, total, done in transfers if total)
+        return {
+            'active': transfers,
+            'completed': completed,
+            'bytes': total_bytes,
+            'speed': speed,
+            'eta': remaining / speed if speed > 0 and remaining > 0 else None
+        }
+
+    def format_status(self, snapshot):
+        parts = [f"↓ {len(snapshot['active'])}个传输 {format_size(snapshot['speed'])}/s"]
+        if snapshot['eta'] is not None:
+            parts[0] += f" 剩余{format_eta(snapshot['eta'])}"
+        for name, total, done in snapshot['active']:
+            percent = f"{done / total * 100:.0f}%" if total else format_size(done)
+            parts.append(f"{fit_width(name, 16)} {percent}")
+        return ' | '.join(parts)
+
+    def format_summary(self, snapshot):
+        text = (f"[进度] 传输中 {len(snapshot['active'])} 个, 已完成 {snapshot['completed']} 个, "
+                f"累计 {format_size(snapshot['bytes'])}, {format_size(snapshot['speed'])}/s")
+        if snapshot['eta'] is not None:
+            text += f", 当前传输剩余约 {format_eta(snapshot['eta'])}"
+        return text
+
+    def show_status(self, text):
+        width = shutil.get_terminal_size((80, 20)).columns - 1
+        with self._output_lock:
+            if not self._line_start:
+                return
+            self._stdout.write('\r' + fit_width(text, width) + '\x1b[K')
+            self._stdout.flush()
+            self._status_shown = True
+
+    def clear_status(self):
+        with self._output_lock:
+            if self._status_shown:
+                self._stdout.write('\r\x1b[K')
+                self._status_shown = False
+
+
+class _StatusAwareStream:
+    """替代sys.stdout，写入前清除状态栏"""
+
+    def __init__(self, stream, reporter):
+        self._stream = stream
+        self._reporter = reporter
+
+    def write(self, text):
+        with self._reporter._output_lock:
+            self._reporter.clear_status()
+            if text:
+                self._reporter._line_start = text.endswith('\n')
+            return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def display_width(text):
+    return sum(2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1 for ch in text)
+
+
+def fit_width(text, width):
+    """按终端显示宽度截断（中文字符占两列）"""
+    if display_width(text) <= width:
+        return text
+    result = ''
+    used = 0
+    for ch in text:
+        w = 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+        if used + w > width - 1:
+            break
+        result += ch
+        used += w
+    return result + '…'
+
+
+def format_size(nbytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if nbytes < 1024 or unit == 'GB':
+            return f"{nbytes:.1f}{unit}" if unit != 'B' else f"{nbytes:.0f}B"
+        nbytes /= 1024
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
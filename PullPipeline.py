@@ -0,0 +1,177 @@
+import queue
+import threading
+
+from SyncMetrics import SyncMetrics
+
+
+class PullPipeline:
+    """分阶段下载流水线：解析链接 → 传输 → 后处理（ffmpeg），各阶段有独立的线程数，
+    阶段之间用有界队列连接，下游变慢时上游自动等待，避免提前解析过多链接或堆积临时文件
+    """
+
+    # 队列结束标记
+    DONE = object()
+
+    def __init__(self, repo, repo_name, config, workers=1, post_workers=None, resolve_workers=None, journal=None):
+        self.repo = repo
+        self.repo_name = repo_name
+        self.config = config
+        self.repo_path = repo.get_repo_path(repo_name)
+        # 同步日志（SyncJournal），每个视频完成一个阶段后写入
+        self.journal = journal
+
+        self.workers = max(1, workers)
+        self.post_workers = max(1, post_workers or repo.post_workers)
+        self.resolve_workers = max(1, resolve_workers or min(self.workers, 4))
+
+        # 下载链接有时效，只提前解析传输线程数量的视频；待合并的任务最多与后处理线程数相同
+        self.resolve_queue = queue.Queue(maxsize=self.resolve_workers * 2)
+        self.transfer_queue = queue.Queue(maxsize=self.workers)
+        self.post_queue = queue.Queue(maxsize=self.post_workers)
+
+        self._lock = threading.Lock()
+        # 已进入流水线的视频数，视频列表可以是生成器，全部进入后listed才为True
+        self.total = 0
+        self.listed = False
+        self.finished = 0
+        self.downloaded = 0
+
+    def run(self, videos):
+        """下载视频列表（可以是边获取边产出的生成器），每个视频完成后立即提交，返回成功数量"""
+        stages = [
+            (self.resolve_queue, self.resolve_workers, self.resolve, self.transfer_queue),
+            (self.transfer_queue, self.workers, self.transfer, self.post_queue),
+            (self.post_queue, self.post_workers, self.postprocess, None),
+        ]
+        threads = []
+        for in_queue, count, func, out_queue in stages:
+            stage_threads = [threading.Thread(target=SyncMetrics.bind(self.stage_worker),
+                                              args=(in_queue, func, out_queue, func.__name__), daemon=True)
+                             for _ in range(count)]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        try:
+            # 解析队列满时暂停读取列表，列表再长也只有少量视频在内存中等待
+            for video in videos:
+                with self._lock:
+                    self.total += 1
+                self.resolve_queue.put({'video': video, 'lock': None, 'key': None, 'finished': False})
+            with self._lock:
+                self.listed = True
+        finally:
+            # 上游阶段全部结束后再通知下游结束
+            for (in_queue, count, _, _), stage_threads in zip(stages, threads):
+                for _ in range(count):
+                    in_queue.put(self.DONE)
+                for thread in stage_threads:
+                    thread.join()
+
+        return self.downloaded
+
+    def stage_worker(self, in_queue, func, out_queue, stage_name):
+        metrics = SyncMetrics.current()
+        while True:
+            job = in_queue.get()
+            if job is self.DONE:
+                return
+
+            try:
+                with metrics.item(job['video']['bvid']), metrics.stage(stage_name):
+                    result = func(job)
+            except Exception as e:
+                print(f"下载出错 {job['video']['title']}: {e}")
+                result = None
+                if not job['finished']:
+                    self.finish(job, False)
+
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+
+    def resolve(self, job):
+        """解析阶段：共享存储中已有时直接链接，否则获取下载链接"""
+        repo = self.repo
+        video = job['video']
+        quality = self.config['quality']
+        audio_only = self.config['audio_only']
+        job['target_dir'] = self.repo_path
+        job['file_name'] = video['title']
+
+        if repo.media_store:
+            # 锁在后处理完成（或失败）后由finish释放，避免两个仓库同时下载同一个对象
+            key = repo.media_store.object_key(video['bvid'], quality, audio_only)
+            job['lock'] = repo.object_lock(key)
+            job['lock'].acquire()
+            job['key'] = key
+            if repo.link_stored_media(key, video['title'], self.repo_path, audio_only):
+                self.finish(job, True)
+                return None
+            job['target_dir'] = repo.media_store.root
+            job['file_name'] = key
+
+        resolved = repo.resolve_video(video, quality)
+        if not resolved:
+            self.finish(job, False)
+            return None
+
+        job['cid'], job['urls'] = resolved
+        self.mark(job, 'resolved')
+        return job
+
+    def transfer(self, job):
+        """传输阶段：下载到临时文件，合并等后处理交给后处理阶段"""
+        post = self.repo.transfer_media(job['urls'], job['file_name'], job['target_dir'], self.config['audio_only'])
+        if post is None:
+            self.fail_download(job)
+            return None
+        job['post'] = post
+        self.mark(job, 'transferred')
+        return job
+
+    def postprocess(self, job):
+        """后处理阶段：运行ffmpeg，链接共享对象并提交记录"""
+        if not self.repo.postprocess_media(job['post']):
+            self.fail_download(job)
+            return None
+
+        ok = True
+        if job['key']:
+            ok = self.repo.link_stored_media(job['key'], job['video']['title'], self.repo_path, self.config['audio_only'])
+        self.finish(job, ok)
+        return None
+
+    def fail_download(self, job):
+        self.repo.invalidate_download_url(job['video']['bvid'], job['cid'], self.config['quality'])
+        self.finish(job, False)
+
+    def mark(self, job, status):
+        if self.journal is not None:
+            self.journal.mark(job['video']['bvid'], status, job.get('cid'))
+
+    def finish(self, job, ok):
+        """记录一个视频的最终结果并释放共享对象锁"""
+        video = job['video']
+        job['finished'] = True
+        if job['lock'] is not None:
+            job['lock'].release()
+            job['lock'] = None
+
+        if ok:
+            try:
+                self.repo.record_video(self.repo_name, self.config, video)
+            except Exception as e:
+                print(f"保存记录失败 {video['title']}: {e}")
+                ok = False
+
+        self.mark(job, 'done' if ok else 'failed')
+        SyncMetrics.current().item_result(video['bvid'], ok)
+        with self._lock:
+            self.finished += 1
+            # 列表还在获取中时总数后加+
+            total = f"{self.total}" if self.listed else f"{self.total}+"
+            if ok:
+                self.downloaded += 1
+                print(f"[{self.finished}/{total}] ✓ {video['title']}")
+            else:
+                print(f"[{self.finished}/{total}] ✗ 下载失败: {video['title']}")
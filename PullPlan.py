@@ -0,0 +1,121 @@
+import time
+
+from SyncMetrics import SyncMetrics
+
+
+class PullPlan:
+    """边获取云端列表边决定需要下载的视频，列表获取完后再计算需要删除的视频
+
+    本地没有的视频在列表中出现时立即交给下载，不必等所有页获取完；
+    删除只在列表完整时计算，避免因中途出错的列表误删本地视频
+    """
+
+    def __init__(self, repo, repo_name, config, full_sync, journal=None):
+        self.repo = repo
+        self.repo_name = repo_name
+        self.config = config
+        self.full_sync = full_sync
+        # 同步日志（SyncJournal），列表中的视频和列表是否完整在此写入；继续上次的同步时为None
+        self.journal = journal
+
+        self.local_bvids = set(config['video_list'].keys())
+        self.current_bvids = set()
+        self.fav_times = {}
+        self.download_count = 0
+        # 列表结束后计算：需要删除的bvid集合，列表为空且为完整同步时为None（视为获取失败）
+        self.to_delete = None
+        # 列表是否完整获取，不完整时本次同步只算部分完成
+        self.complete = True
+        # 尚未写入同步日志的视频 [(视频, 是否下载), ...]，每满一页或每秒写入一次
+        self._listed = []
+        self._last_flush = time.time()
+
+        print(f"本地视频: {len(self.local_bvids)} 个")
+
+    def add(self, video):
+        """记录云端列表中的一个视频，返回是否需要下载"""
+        bvid = video['bvid']
+        if bvid in self.current_bvids:
+            return False
+        self.current_bvids.add(bvid)
+
+        download = bvid not in self.local_bvids
+        if self.journal is not None:
+            self._listed.append((video, download))
+            if len(self._listed) >= self.repo.fav_page_size or time.time() - self._last_flush >= 1:
+                self.flush_listed()
+        if not download:
+            # 补全已有记录的收藏时间，供之后的增量同步使用
+            self.config['video_list'][bvid]['fav_time'] = video['fav_time']
+            self.fav_times[bvid] = video['fav_time']
+            return False
+        self.download_count += 1
+        return True
+
+    def filter(self, videos, listing=None):
+        """逐个检查云端列表（可以是生成器），产出需要下载的视频；listing为列表获取状态，complete为False时不删除"""
+        metrics = SyncMetrics.current()
+        videos = iter(videos)
+        while True:
+            with metrics.phase('listing'):
+                video = next(videos, None)
+            if video is None:
+                break
+            if self.add(video):
+                yield video
+        self.finish(listing)
+
+    async def filter_async(self, videos, listing=None):
+        """filter的异步版本，videos可以是异步迭代器"""
+        if not hasattr(videos, '__aiter__'):
+            for video in self.filter(videos, listing):
+                yield video
+            return
+
+        metrics = SyncMetrics.current()
+        videos = videos.__aiter__()
+        while True:
+            with metrics.phase('listing'):
+                try:
+                    video = await videos.__anext__()
+                except StopAsyncIteration:
+                    break
+            if self.add(video):
+                yield video
+        self.finish(listing)
+
+    def flush_listed(self):
+        """将缓存的列表视频一次写入同步日志"""
+        if self._listed:
+            self.journal.add_listed(self._listed)
+            self._listed = []
+        self._last_flush = time.time()
+
+    def finish(self, listing=None):
+        """列表结束：保存收藏时间，计算需要删除的视频（本地有但云端没有）"""
+        self.repo.get_repo_store(self.repo_name).update_fav_times(self.fav_times)
+        complete = listing is None or listing.get('complete', True)
+        self.complete = complete
+        if self.journal is not None:
+            self.flush_listed()
+            # 完整同步得到空列表视为获取失败，不能沿用
+            self.journal.finish_listing(complete and (bool(self.current_bvids) or not self.full_sync))
+
+        if self.full_sync and not self.current_bvids:
+            print("获取收藏夹视频列表失败")
+            return
+
+        if self.full_sync and complete:
+            self.to_delete = self.local_bvids - self.current_bvids
+        else:
+            # 增量同步或列表不完整时无法判断哪些视频已被移除
+            self.to_delete = set()
+            if self.full_sync:
+                print("收藏夹列表获取不完整，本次不删除本地视频")
+
+        if self.full_sync:
+            print(f"云端视频: {len(self.current_bvids)} 个")
+        else:
+            print(f"云端新增: {len(self.current_bvids)} 个")
+        print(f"需要删除: {len(self.to_delete)} 个")
+        print(f"需要下载: {self.download_count} 个")
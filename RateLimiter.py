@@ -0,0 +1,55 @@
+import random
+import threading
+import time
+
+
+class RateLimiter:
+    """自适应令牌桶限速器：请求成功时逐步提速，遇到风控响应时减半降速，并提供带抖动的指数退避"""
+
+    def __init__(self, rate=5.0, burst=5, min_rate=0.2, max_rate=20.0,
+                 increase=0.2, backoff_base=1.0, backoff_max=60.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """预定一个令牌，返回需要等待的秒数（异步代码中配合asyncio.sleep使用）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """阻塞直到获得一个令牌"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        """请求成功，线性提高速率"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        """遇到风控，速率减半并清空令牌"""
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def backoff_delay(self, attempt):
+        """第attempt次重试前的等待时间（全抖动指数退避）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
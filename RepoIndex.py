@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from RepoStore import RepoStore
+
+
+class RepoIndex:
+    """基础目录级别的仓库索引，保存各仓库的ID、名称、数量和同步时间，避免每次命令都读取所有仓库"""
+
+    FILE_NAME = ".bili_repos_index.json"
+    VERSION = 1
+
+    # 索引中每个仓库保存的配置字段
+    FIELDS = ('repo_id', 'fid', 'fav_title', 'fav_upper', 'quality', 'audio_only', 'last_sync')
+
+    def __init__(self, base_dir):
+        self.base_dir = Path(base_dir)
+        self.path = self.base_dir / self.FILE_NAME
+        self._lock = threading.Lock()
+        self._data = None
+        # 上次读取或写入时索引文件的 (文件号, 修改时间, 大小)，变化时说明其他进程或实例更新过，需要重新读取
+        self._signature = None
+
+    def make_entry(self, config, video_count):
+        entry = {field: config.get(field) for field in self.FIELDS}
+        entry['video_count'] = video_count
+        return entry
+
+    def scan_dirs(self):
+        """列出基础目录下的所有子目录名（不读取仓库内容）"""
+        with os.scandir(self.base_dir) as it:
+            return {entry.name for entry in it if entry.is_dir()}
+
+    def is_stale(self, data):
+        """索引版本不符，或目录增删后与索引记录不一致时视为过期"""
+        if data.get('version') != self.VERSION:
+            return True
+        known = set(data.get('repos', {})) | set(data.get('others', []))
+        return known != self.scan_dirs()
+
+    def load(self):
+        """读取索引，不存在或过期时重建"""
+        with self._lock:
+            self._read()
+            if self.is_stale(self._data):
+                self._rebuild()
+            return self._data
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        # 写入通过改名完成，文件号也会变化，修改时间精度较低时同样能发现
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read(self):
+        """索引文件自上次读取或写入后有变化时重新读取"""
+        signature = self._file_signature()
+        if self._data is not None and signature == self._signature:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+        self._signature = signature
+
+    def entries(self):
+        """返回 {仓库名: 索引项}"""
+        return self.load()['repos']
+
+    def rebuild(self):
+        with self._lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        repos = {}
+        others = []
+        for name in sorted(self.scan_dirs()):
+            repo_path = self.base_dir / name
+            if not RepoStore.exists(repo_path):
+                others.append(name)
+                continue
+
+            try:
+                store = RepoStore(repo_path)
+                try:
+                    config = store.load_config(with_videos=False)
+                    if config:
+                        repos[name] = self.make_entry(config, store.count_videos())
+                finally:
+                    store.close()
+            except Exception as e:
+                print(f"读取仓库失败 {name}: {e}")
+                others.append(name)
+
+        self._data = {'version': self.VERSION, 'repos': repos, 'others': others}
+        self._save()
+
+    def _save(self):
+        # 临时文件名带进程号和线程号，多个进程或实例同时写入时不会互相覆盖临时文件
+        tmp_path = self.path.with_name(f"{self.FILE_NAME}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._signature = self._file_signature()
+
+    def update(self, repo_name, config, video_count):
+        """仓库配置写入后更新对应的索引项
+
+        写入前重新读取索引文件，只替换这一个仓库的索引项，不会用本实例缓存的旧数据覆盖其他进程的更新
+        """
+        with self._lock:
+            self._read()
+            if self._data.get('version') != self.VERSION:
+                self._rebuild()
+
+            self._data['repos'][repo_name] = self.make_entry(config, video_count)
+            if repo_name in self._data['others']:
+                self._data['others'].remove(repo_name)
+            self._save()
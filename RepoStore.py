@@ -0,0 +1,241 @@
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+from pathlib import Path
+
+# 网络文件系统类型（/proc/mounts 和 mount 命令中的名称），SQLite的WAL模式在这些文件系统上不可靠
+NETWORK_FILESYSTEMS = {
+    'nfs', 'nfs4', 'cifs', 'smbfs', 'smb2', 'smb3', 'afs', '9p', 'ceph', 'glusterfs', 'lustre', 'gpfs',
+    'ncpfs', 'coda', 'davfs', 'webdav', 'sshfs', 'fuse.sshfs', 'fuse.glusterfs', 'fuse.ceph', 'fuse.rclone',
+    'fuse.s3fs', 'fuse.davfs', 'afpfs',
+}
+
+
+class RepoStore:
+    """基于SQLite的仓库存储，每个视频下载完成后立即提交，崩溃时不会丢失已下载的记录"""
+
+    DB_NAME = ".bili_repo.db"
+    LEGACY_NAME = ".bili_repo.json"
+
+    # video_list中每条记录保存的字段
+    VIDEO_FIELDS = ('title', 'upper', 'duration', 'pubdate', 'fav_time', 'cid', 'download_time')
+    # 文件状态索引中每个文件保存的字段
+    FILE_FIELDS = ('name', 'size', 'mtime_ns', 'hash')
+
+    def __init__(self, repo_path):
+        self.repo_path = Path(repo_path)
+        self.db_path = self.repo_path / self.DB_NAME
+        self.legacy_path = self.repo_path / self.LEGACY_NAME
+        self._lock = threading.Lock()
+
+        self.conn = connect_database(self.db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS videos (
+                bvid TEXT PRIMARY KEY,
+                title TEXT,
+                upper TEXT,
+                duration INTEGER,
+                pubdate INTEGER,
+                fav_time INTEGER,
+                cid INTEGER,
+                download_time TEXT
+            )
+        ''')
+        # 文件状态索引：verify检查通过时的文件名、大小、修改时间和可选的快速哈希
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                bvid TEXT PRIMARY KEY,
+                name TEXT,
+                size INTEGER,
+                mtime_ns INTEGER,
+                hash TEXT
+            )
+        ''')
+        self.conn.commit()
+
+        if self.legacy_path.exists() and not self.has_meta():
+            self.migrate_legacy()
+
+    @classmethod
+    def exists(cls, repo_path):
+        """仓库目录中是否有仓库配置（数据库或旧版JSON）"""
+        repo_path = Path(repo_path)
+        return (repo_path / cls.DB_NAME).exists() or (repo_path / cls.LEGACY_NAME).exists()
+
+    def has_meta(self):
+        return self.conn.execute('SELECT 1 FROM meta LIMIT 1').fetchone() is not None
+
+    def migrate_legacy(self):
+        """从旧版.bili_repo.json迁移，迁移后将其重命名为.bili_repo.json.bak"""
+        with open(self.legacy_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        self.save_config(config)
+        os.replace(self.legacy_path, self.legacy_path.with_name(self.LEGACY_NAME + '.bak'))
+        print(f"✓ 已将仓库配置迁移到 {self.DB_NAME}: {self.repo_path.name}")
+
+    def load_config(self, with_videos=True):
+        """读取仓库配置，返回与旧版JSON相同结构的字典"""
+        with self._lock:
+            rows = self.conn.execute('SELECT key, value FROM meta').fetchall()
+            if not rows:
+                return None
+
+            config = {key: json.loads(value) for key, value in rows}
+            config['video_list'] = self._load_videos() if with_videos else {}
+        return config
+
+    def _load_videos(self):
+        columns = ', '.join(self.VIDEO_FIELDS)
+        video_list = {}
+        for row in self.conn.execute(f'SELECT bvid, {columns} FROM videos ORDER BY rowid'):
+            video_list[row[0]] = dict(zip(self.VIDEO_FIELDS, row[1:]))
+        return video_list
+
+    def save_meta(self, config):
+        """保存除video_list外的仓库配置"""
+        with self._lock, self.conn:
+            self._save_meta(config)
+
+    def _save_meta(self, config):
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            [(key, json.dumps(value, ensure_ascii=False)) for key, value in config.items() if key != 'video_list']
+        )
+
+    def save_config(self, config):
+        """在一个事务中保存完整配置，video_list与数据库中的记录保持一致"""
+        video_list = config.get('video_list', {})
+        with self._lock, self.conn:
+            self._save_meta(config)
+            existing = {row[0] for row in self.conn.execute('SELECT bvid FROM videos')}
+            removed = existing - set(video_list)
+            self.conn.executemany('DELETE FROM videos WHERE bvid = ?', [(bvid,) for bvid in removed])
+            self.conn.executemany('DELETE FROM files WHERE bvid = ?', [(bvid,) for bvid in removed])
+            self.conn.executemany(self._upsert_sql(), [self._video_row(bvid, info) for bvid, info in video_list.items()])
+
+    def _upsert_sql(self):
+        columns = ', '.join(('bvid',) + self.VIDEO_FIELDS)
+        placeholders = ', '.join('?' * (len(self.VIDEO_FIELDS) + 1))
+        return f'INSERT OR REPLACE INTO videos ({columns}) VALUES ({placeholders})'
+
+    def _video_row(self, bvid, info):
+        return (bvid,) + tuple(info.get(field) for field in self.VIDEO_FIELDS)
+
+    def add_video(self, bvid, info):
+        """记录一个已下载的视频并立即提交"""
+        with self._lock, self.conn:
+            self.conn.execute(self._upsert_sql(), self._video_row(bvid, info))
+
+    def remove_videos(self, bvids):
+        """删除视频记录及其文件状态"""
+        with self._lock, self.conn:
+            self.conn.executemany('DELETE FROM videos WHERE bvid = ?', [(bvid,) for bvid in bvids])
+            self.conn.executemany('DELETE FROM files WHERE bvid = ?', [(bvid,) for bvid in bvids])
+
+    def load_file_index(self):
+        """读取文件状态索引 {bvid: {'name', 'size', 'mtime_ns', 'hash'}}"""
+        columns = ', '.join(self.FILE_FIELDS)
+        with self._lock:
+            rows = self.conn.execute(f'SELECT bvid, {columns} FROM files').fetchall()
+        return {row[0]: dict(zip(self.FILE_FIELDS, row[1:])) for row in rows}
+
+    def save_file_index(self, entries):
+        """批量写入文件状态 {bvid: {'name', 'size', 'mtime_ns', 'hash'}}"""
+        columns = ', '.join(('bvid',) + self.FILE_FIELDS)
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO files ({columns}) VALUES (?, ?, ?, ?, ?)',
+                [(bvid,) + tuple(entry.get(field) for field in self.FILE_FIELDS) for bvid, entry in entries.items()])
+
+    def update_fav_times(self, fav_times):
+        """批量更新视频的收藏时间 {bvid: fav_time}"""
+        with self._lock, self.conn:
+            self.conn.executemany('UPDATE videos SET fav_time = ? WHERE bvid = ?',
+                                  [(fav_time, bvid) for bvid, fav_time in fav_times.items()])
+
+    def get_video(self, bvid):
+        """按bvid查找视频记录，不存在时返回None"""
+        columns = ', '.join(self.VIDEO_FIELDS)
+        with self._lock:
+            row = self.conn.execute(f'SELECT {columns} FROM videos WHERE bvid = ?', (bvid,)).fetchone()
+        return dict(zip(self.VIDEO_FIELDS, row)) if row else None
+
+    def count_videos(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def connect_database(db_path):
+    """打开仓库目录中的SQLite数据库，可在多个线程中使用
+
+    本地文件系统上使用WAL模式，提交快且读写互不阻塞；WAL依赖共享内存，在NAS、网络驱动器等
+    网络文件系统上可能损坏数据库或一直提示被锁定，此时（以及无法确定时）使用默认的回滚日志
+    """
+    conn = sqlite3.connect(str(db_path), check_same_thread=False)
+    if is_local_filesystem(Path(db_path).parent):
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+    else:
+        # 之前在本地使用过的数据库会保持WAL模式，需要显式切换回来
+        conn.execute('PRAGMA journal_mode=DELETE')
+    return conn
+
+
+def is_local_filesystem(path):
+    """目录是否在本地文件系统上，无法确定时返回False"""
+    path = os.path.realpath(path)
+    try:
+        if os.name == 'nt':
+            return _is_local_drive(path)
+        fs_type = _mount_fs_type(path)
+    except Exception:
+        return False
+    return fs_type is not None and fs_type.lower() not in NETWORK_FILESYSTEMS
+
+
+def _is_local_drive(path):
+    import ctypes
+
+    drive = os.path.splitdrive(path)[0]
+    # UNC路径（\\server\share）是网络共享
+    if not drive or drive.startswith('\\\\'):
+        return False
+    # 0: 未知, 1: 无效路径, 4: 网络驱动器
+    return ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') not in (0, 1, 4)
+
+
+def _mount_fs_type(path):
+    """路径所在挂载点的文件系统类型，找不到时返回None"""
+    mounts = []
+    if os.path.exists('/proc/mounts'):
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3:
+                    # 挂载点中的空格等字符被转义为八进制
+                    mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1])
+                    mounts.append((mount_point, fields[2]))
+    else:
+        # macOS/BSD: "设备 on 挂载点 (类型, 选项...)"
+        output = subprocess.run(['mount'], capture_output=True, text=True, check=True).stdout
+        for line in output.splitlines():
+            if ' on ' in line and ' (' in line:
+                rest = line.split(' on ', 1)[1]
+                mount_point, options = rest.rsplit(' (', 1)
+                mounts.append((mount_point, options.split(',')[0].strip(' )')))
+
+    best = None
+    for mount_point, fs_type in mounts:
+        prefix = mount_point.rstrip('/') + '/'
+        if (path + '/').startswith(prefix) and (best is None or len(mount_point) > len(best[0])):
+            best = (mount_point, fs_type)
+    return best[1] if best else None
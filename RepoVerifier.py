@@ -0,0 +1,191 @@
+import hashlib
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RepoVerifier:
+    """检查仓库中已下载的文件是否完整（verify/fsck）
+
+    每个文件检查通过后在仓库数据库中记录大小和修改时间（deep模式下还有快速哈希），
+    之后状态未变的文件不再读取，只有新增或变化过的文件用ffprobe解析一遍。
+    缺失或损坏的视频从记录中移除，下次同步时重新下载
+    """
+
+    def __init__(self, repo, workers=16, probe_workers=None, sample_size=1024 * 1024):
+        self.repo = repo
+        # 读取文件状态（及计算哈希）的线程数，以及同时运行的ffprobe进程数
+        self.workers = max(1, workers)
+        self.probe_workers = max(1, probe_workers or os.cpu_count() or 1)
+        # 快速哈希只读取文件开头和结尾各sample_size字节
+        self.sample_size = sample_size
+        self._ffprobe_missing = False
+
+    def verify(self, repo_name, deep=False, repair=True):
+        """检查一个仓库，返回统计 {'total', 'unchanged', 'probed', 'missing', 'damaged'}，仓库不存在时返回None
+
+        deep为True时对所有文件计算快速哈希并与记录比较，可以发现大小和修改时间都没变的损坏；
+        repair为True时删除损坏的文件并移除缺失和损坏视频的记录，下次同步时重新下载
+        """
+        config = self.repo.load_repo_config(repo_name)
+        if not config:
+            print(f"仓库 '{repo_name}' 不存在")
+            return None
+
+        start = time.time()
+        store = self.repo.get_repo_store(repo_name)
+        repo_path = self.repo.get_repo_path(repo_name)
+        extension = '.m4a' if config['audio_only'] else '.mp4'
+        index = store.load_file_index()
+        videos = list(config['video_list'].items())
+        print(f"正在检查仓库: {repo_name} ({len(videos)} 个文件)")
+
+        # 每个视频实际对应的文件，修改下载模式后保留的旧文件扩展名可能与当前模式不同
+        paths = {}
+
+        def check(item):
+            bvid, info = item
+            entry = index.get(bvid)
+            paths[bvid] = self.find_file(repo_path, info['title'], entry, extension)
+            return self.check_file(paths[bvid], entry, deep)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = dict(zip((bvid for bvid, _ in videos), executor.map(check, videos)))
+
+        # 状态有变化的文件用ffprobe确认能完整解析
+        to_probe = [bvid for bvid, (status, _) in results.items() if status == 'changed']
+        if to_probe:
+            print(f"用ffprobe检查 {len(to_probe)} 个新增或变化过的文件...")
+
+            with ThreadPoolExecutor(max_workers=self.probe_workers) as executor:
+                for bvid, ok in zip(to_probe, executor.map(self.probe_file, [paths[bvid] for bvid in to_probe])):
+                    status, entry = results[bvid]
+                    if ok is None:
+                        # 没有ffprobe时无法确认，不写入索引，下次仍会检查
+                        results[bvid] = ('unverified', entry)
+                    else:
+                        results[bvid] = ('ok' if ok else 'damaged', entry)
+
+        verified = {bvid: entry for bvid, (status, entry) in results.items() if status in ('ok', 'unchanged')}
+        store.save_file_index({bvid: entry for bvid, entry in verified.items() if entry != index.get(bvid)})
+
+        broken = {bvid: status for bvid, (status, _) in results.items() if status in ('missing', 'damaged')}
+        for bvid, status in broken.items():
+            mark = '缺失' if status == 'missing' else '损坏'
+            print(f"✗ {mark}: {config['video_list'][bvid]['title']}")
+        if broken and repair:
+            self.queue_redownload(repo_name, config, broken, paths)
+
+        statuses = [status for status, _ in results.values()]
+        stats = {
+            'total': len(videos),
+            'unchanged': statuses.count('unchanged'),
+            'probed': len(to_probe),
+            'unverified': statuses.count('unverified'),
+            'missing': statuses.count('missing'),
+            'damaged': statuses.count('damaged'),
+        }
+        print(f"检查完成: 共 {stats['total']} 个, 未变化 {stats['unchanged']} 个, ffprobe检查 {stats['probed']} 个, "
+              f"缺失 {stats['missing']} 个, 损坏 {stats['damaged']} 个 ({time.time() - start:.1f}s)")
+        if stats['unverified']:
+            print(f"未找到ffprobe，{stats['unverified']} 个文件只检查了是否存在")
+        if broken:
+            if repair:
+                print(f"已将 {len(broken)} 个视频加入下次同步的下载队列")
+            else:
+                print("使用 verify 并允许修复后，这些视频会在下次同步时重新下载")
+        return stats
+
+    def find_file(self, repo_path, title, entry, extension):
+        """视频对应的文件：优先使用索引中记录的文件名，其次当前模式的扩展名，最后另一种模式的扩展名；
+        都不存在时返回当前模式的路径"""
+        names = [entry['name']] if entry and entry.get('name') else []
+        names += [f"{title}{ext}" for ext in (extension, '.m4a', '.mp4')]
+        for name in dict.fromkeys(names):
+            path = repo_path / name
+            if path.exists():
+                return path
+        return repo_path / f"{title}{extension}"
+
+    def check_file(self, path, entry, deep):
+        """检查一个文件的状态，返回 (结果, 新的索引项)
+
+        结果为 'unchanged'（与索引一致）、'changed'（需要ffprobe检查）、'missing' 或 'damaged'
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 'missing', None
+        if stat.st_size == 0:
+            return 'damaged', None
+
+        current = {'name': path.name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                   'hash': entry['hash'] if entry else None}
+        unchanged = entry is not None and all(entry[field] == current[field] for field in ('name', 'size', 'mtime_ns'))
+        if deep:
+            try:
+                current['hash'] = self.fast_hash(path, stat.st_size)
+            except OSError:
+                return 'damaged', None
+            if unchanged and entry['hash'] is not None and entry['hash'] != current['hash']:
+                unchanged = False
+        return ('unchanged' if unchanged else 'changed'), current
+
+    def fast_hash(self, path, size):
+        """文件大小加上开头和结尾各sample_size字节的哈希，不读取整个文件"""
+        digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+        with open(path, 'rb') as f:
+            digest.update(f.read(self.sample_size))
+            if size > self.sample_size:
+                f.seek(max(self.sample_size, size - self.sample_size))
+                digest.update(f.read(self.sample_size))
+        return digest.hexdigest()
+
+    def probe_file(self, path):
+        """用ffprobe读取所有数据包，能完整解析时返回True，截断或损坏时返回False，没有ffprobe时返回None"""
+        if self._ffprobe_missing:
+            return None
+
+        cmd = ['ffprobe', '-v', 'error', '-count_packets', '-show_entries', 'format=duration',
+               '-of', 'default=noprint_wrappers=1:nokey=1', str(path)]
+        try:
+            result = subprocess.run(cmd, capture_output=True)
+        except FileNotFoundError:
+            self._ffprobe_missing = True
+            return None
+        # 截断的文件通常能读出文件头，但读取数据包时会在stderr报错
+        return result.returncode == 0 and not result.stderr.strip()
+
+    def queue_redownload(self, repo_name, config, broken, paths):
+        """删除损坏的文件并移除记录；下次同步强制完整同步，增量同步也能找回这些视频
+
+        损坏的文件是共享存储中的链接时删除共享对象本身，否则重新同步时会再次链接到同一个损坏的对象；
+        其他仓库中链接到该对象的视频也一并加入下载队列
+        """
+        others = {}
+        for bvid, status in broken.items():
+            file_path = paths[bvid]
+            if status != 'damaged':
+                continue
+            try:
+                keys = self.repo.discard_stored_media(file_path)
+                if keys is None:
+                    self.repo.remove_media_file(file_path)
+                    continue
+                for key in keys:
+                    other_repo, _, file_name = key.partition('/')
+                    if other_repo != repo_name:
+                        others.setdefault(other_repo, set()).add(os.path.splitext(file_name)[0])
+            except Exception as e:
+                print(f"删除失败 {file_path.name}: {e}")
+        self.repo.requeue_videos(repo_name, config, list(broken))
+
+        for other_repo, titles in others.items():
+            other_config = self.repo.load_repo_config(other_repo)
+            if not other_config:
+                continue
+            bvids = [bvid for bvid, info in other_config['video_list'].items() if info['title'] in titles]
+            if bvids:
+                print(f"仓库 '{other_repo}' 中链接到同一损坏文件的 {len(bvids)} 个视频也已加入下载队列")
+                self.repo.requeue_videos(other_repo, other_config, bvids)
@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from RepoStore import connect_database
+
+
+class SyncJournal:
+    """仓库目录下的同步日志（预写式）：先记录收藏夹列表和计划下载的视频，每个视频每完成一步立即提交
+
+    只保留最近一次同步。同步被中断后，pull --resume 沿用日志中足够新的完整列表，不重新获取收藏夹列表；
+    列表未获取完整时先继续已列出但未完成的视频。已完成的视频都会跳过
+    """
+
+    DB_NAME = ".bili_pull_journal.db"
+
+    def __init__(self, repo_path):
+        self.path = Path(repo_path) / self.DB_NAME
+        self._lock = threading.Lock()
+
+        # 与仓库数据库相同：只在本地文件系统上使用WAL模式
+        self.conn = connect_database(self.path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS listing (
+                position INTEGER PRIMARY KEY,
+                bvid TEXT UNIQUE NOT NULL,
+                video TEXT NOT NULL
+            )
+        ''')
+        # 待下载视频的状态：pending -> resolved -> transferred -> done / failed
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS items (
+                bvid TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                cid INTEGER,
+                updated REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS deletes (bvid TEXT PRIMARY KEY)')
+        self.conn.commit()
+
+    def state(self):
+        """上次同步的状态 {'state', 'started', 'full_sync', 'listing_complete', 'listed_at'}，没有记录时返回空字典"""
+        with self._lock:
+            rows = self.conn.execute('SELECT key, value FROM meta').fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def _set_meta(self, **values):
+        self.conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                              [(key, json.dumps(value)) for key, value in values.items()])
+
+    def unfinished(self):
+        return self.state().get('state') not in (None, 'done')
+
+    def resumable(self, max_age):
+        """上次同步未完成且在max_age秒内开始时可以继续（列表不完整时只能沿用已记录的部分）"""
+        state = self.state()
+        if state.get('state') in (None, 'done'):
+            return False
+        listed_at = state.get('listed_at') or datetime.fromisoformat(state['started']).timestamp()
+        return time.time() - listed_at <= max_age
+
+    def begin(self, full_sync):
+        """开始一次新的同步，清除上次的记录"""
+        with self._lock, self.conn:
+            for table in ('meta', 'listing', 'items', 'deletes'):
+                self.conn.execute(f'DELETE FROM {table}')
+            self._set_meta(state='listing', started=datetime.now().isoformat(), full_sync=full_sync,
+                           listing_complete=False, listed_at=None)
+
+    def add_listed(self, entries):
+        """记录列表中的一批视频 [(视频, 是否下载), ...]，需要下载的同时记为待下载
+
+        每批（通常为一页）只提交一次，没有WAL的网络文件系统上不必每个视频都等待一次日志写入
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO listing (bvid, video) VALUES (?, ?)',
+                                  [(video['bvid'], json.dumps(video, ensure_ascii=False)) for video, _ in entries])
+            self.conn.executemany('INSERT OR IGNORE INTO items (bvid, status, updated) VALUES (?, ?, ?)',
+                                  [(video['bvid'], 'pending', now) for video, download in entries if download])
+
+    def finish_listing(self, complete):
+        with self._lock, self.conn:
+            self._set_meta(state='downloading', listing_complete=complete, listed_at=time.time())
+
+    def listed_videos(self):
+        """按列表顺序返回记录的视频"""
+        with self._lock:
+            rows = self.conn.execute('SELECT video FROM listing ORDER BY position').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def pending_videos(self):
+        """按列表顺序返回计划下载但尚未完成的视频"""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT listing.video FROM listing JOIN items ON items.bvid = listing.bvid '
+                "WHERE items.status != 'done' ORDER BY listing.position").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def mark(self, bvid, status, cid=None):
+        """记录视频完成了一步（resolved、transferred）或最终结果（done、failed）"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO items (bvid, status, cid, updated) '
+                'VALUES (?, ?, COALESCE(?, (SELECT cid FROM items WHERE bvid = ?)), ?)',
+                (bvid, status, cid, bvid, time.time()))
+
+    def counts(self):
+        """各状态的视频数 {状态: 数量}"""
+        with self._lock:
+            rows = self.conn.execute('SELECT status, COUNT(*) FROM items GROUP BY status').fetchall()
+        return dict(rows)
+
+    def plan_deletes(self, bvids):
+        """删除本地视频之前记录要删除的bvid"""
+        with self._lock, self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO deletes (bvid) VALUES (?)', [(bvid,) for bvid in bvids])
+            self._set_meta(state='deleting')
+
+    def finish(self):
+        with self._lock, self.conn:
+            self._set_meta(state='done')
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,268 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+# 当前同步使用的指标对象和正在处理的视频，线程池中运行的函数需要用SyncMetrics.bind传递
+_current = contextvars.ContextVar('bili_sync_metrics', default=None)
+_current_item = contextvars.ContextVar('bili_sync_item', default=None)
+
+
+class SyncMetrics:
+    """一次同步的结构化指标：各阶段耗时、按接口统计的请求数和重试、按视频和CDN主机统计的流量与速度、ffmpeg耗时"""
+
+    def __init__(self, repo_name, engine='sync'):
+        self.repo_name = repo_name
+        self.engine = engine
+        self.started = datetime.now()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+        # 同步流程各阶段的实际耗时 {阶段: 秒}
+        self.phases = {}
+        # 各处理步骤在所有线程中的累计耗时 {步骤: {'count', 'seconds'}}
+        self.stages = {}
+        # {接口路径: {'requests', 'retries', 'throttled', 'errors', 'cache_hits', 'seconds'}}
+        self.requests = {}
+        # {主机: {'requests', 'bytes', 'seconds'}}
+        self.hosts = {}
+        # {bvid: {'bytes', 各步骤的'<步骤>_seconds', 'ok'}}
+        self.items = {}
+
+    @staticmethod
+    def current():
+        """当前上下文中的指标对象，不在同步中时返回不记录任何内容的NullMetrics"""
+        return _current.get() or NULL_METRICS
+
+    @contextmanager
+    def active(self):
+        """在此范围内将self设为当前指标对象"""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    @staticmethod
+    def bind(func):
+        """包装要在其他线程中运行的函数，使其沿用调用方的指标对象和当前视频"""
+        metrics = _current.get()
+        item = _current_item.get()
+
+        def run(*args, **kwargs):
+            token = _current.set(metrics)
+            item_token = _current_item.set(item)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current_item.reset(item_token)
+                _current.reset(token)
+        return run
+
+    @staticmethod
+    @contextmanager
+    def item(bvid):
+        """在此范围内产生的流量和耗时计入该视频"""
+        token = _current_item.set(bvid)
+        try:
+            yield
+        finally:
+            _current_item.reset(token)
+
+    def _item_entry(self, bvid):
+        return self.items.setdefault(bvid, {'bytes': 0})
+
+    @contextmanager
+    def phase(self, name):
+        """记录同步流程一个阶段的实际耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个处理步骤（如resolve、transfer、ffmpeg）的耗时，累加到当前视频"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            bvid = _current_item.get()
+            with self._lock:
+                entry = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+                entry['count'] += 1
+                entry['seconds'] += elapsed
+                if bvid is not None:
+                    item = self._item_entry(bvid)
+                    key = f"{name}_seconds"
+                    item[key] = item.get(key, 0.0) + elapsed
+
+    def _endpoint_entry(self, endpoint):
+        return self.requests.setdefault(endpoint, {'requests': 0, 'retries': 0, 'throttled': 0,
+                                                   'errors': 0, 'cache_hits': 0, 'seconds': 0.0})
+
+    def api_request(self, endpoint, seconds, retry=False):
+        with self._lock:
+            entry = self._endpoint_entry(endpoint)
+            entry['requests'] += 1
+            entry['seconds'] += seconds
+            if retry:
+                entry['retries'] += 1
+
+    def api_throttled(self, endpoint):
+        with self._lock:
+            self._endpoint_entry(endpoint)['throttled'] += 1
+
+    def api_error(self, endpoint):
+        with self._lock:
+            self._endpoint_entry(endpoint)['errors'] += 1
+
+    def api_cache_hit(self, endpoint):
+        with self._lock:
+            self._endpoint_entry(endpoint)['cache_hits'] += 1
+
+    def add_transfer(self, url, nbytes, seconds):
+        """记录一次CDN传输（一个连接）的字节数和耗时"""
+        host = urlparse(url).netloc
+        bvid = _current_item.get()
+        with self._lock:
+            entry = self.hosts.setdefault(host, {'requests': 0, 'bytes': 0, 'seconds': 0.0})
+            entry['requests'] += 1
+            entry['bytes'] += nbytes
+            entry['seconds'] += seconds
+            if bvid is not None:
+                self._item_entry(bvid)['bytes'] += nbytes
+
+    def item_result(self, bvid, ok):
+        with self._lock:
+            self._item_entry(bvid)['ok'] = ok
+
+    def summary(self, ok, stats=None):
+        """生成可序列化为JSON的汇总"""
+        seconds = time.perf_counter() - self._start
+        with self._lock:
+            hosts = {}
+            for host, entry in self.hosts.items():
+                hosts[host] = dict(entry, seconds=round(entry['seconds'], 3),
+                                   mb_per_sec=mb_per_sec(entry['bytes'], entry['seconds']))
+
+            items = {}
+            for bvid, entry in self.items.items():
+                item = {key: round(value, 3) if isinstance(value, float) else value for key, value in entry.items()}
+                # 异步引擎不区分解析和传输步骤，按整个下载步骤计算
+                transfer_seconds = entry.get('transfer_seconds', entry.get('download_seconds'))
+                if transfer_seconds:
+                    item['mb_per_sec'] = mb_per_sec(entry['bytes'], transfer_seconds)
+                items[bvid] = item
+
+            total_bytes = sum(entry['bytes'] for entry in self.hosts.values())
+            return {
+                'repo': self.repo_name,
+                'engine': self.engine,
+                'ok': ok,
+                'started': self.started.isoformat(),
+                'seconds': round(seconds, 3),
+                'phases': {name: round(value, 3) for name, value in self.phases.items()},
+                'stages': {name: {'count': entry['count'], 'seconds': round(entry['seconds'], 3)}
+                           for name, entry in self.stages.items()},
+                'requests': {endpoint: dict(entry, seconds=round(entry['seconds'], 3))
+                             for endpoint, entry in self.requests.items()},
+                'hosts': hosts,
+                'items': items,
+                'totals': dict(stats or {}, bytes=total_bytes, mb_per_sec=mb_per_sec(total_bytes, seconds))
+            }
+
+    @staticmethod
+    def to_prometheus(summaries):
+        """将多个仓库的汇总 {仓库名: summary} 转换为Prometheus文本格式"""
+        metrics = {}
+
+        def add(name, help_text, labels, value):
+            entry = metrics.setdefault(name, (help_text, []))
+            entry[1].append((labels, value))
+
+        for repo_name, summary in summaries.items():
+            repo = {'repo': repo_name}
+            add('bili_pull_success', '上次同步是否成功', repo, 1 if summary['ok'] else 0)
+            add('bili_pull_timestamp_seconds', '上次同步的开始时间',
+                repo, datetime.fromisoformat(summary['started']).timestamp())
+            add('bili_pull_duration_seconds', '上次同步的总耗时', repo, summary['seconds'])
+            for phase, value in summary['phases'].items():
+                add('bili_pull_phase_seconds', '同步各阶段的耗时', dict(repo, phase=phase), value)
+            for stage, entry in summary['stages'].items():
+                add('bili_pull_stage_seconds', '各处理步骤在所有线程中的累计耗时', dict(repo, stage=stage), entry['seconds'])
+                add('bili_pull_stage_count', '各处理步骤的执行次数', dict(repo, stage=stage), entry['count'])
+            for endpoint, entry in summary['requests'].items():
+                labels = dict(repo, endpoint=endpoint)
+                add('bili_api_requests', 'API请求数', labels, entry['requests'])
+                add('bili_api_retries', 'API重试次数', labels, entry['retries'])
+                add('bili_api_throttled', 'API风控响应次数', labels, entry['throttled'])
+                add('bili_api_errors', 'API错误响应次数', labels, entry['errors'])
+                add('bili_api_cache_hits', 'API缓存命中次数', labels, entry['cache_hits'])
+                add('bili_api_seconds', 'API请求累计耗时', labels, entry['seconds'])
+            for host, entry in summary['hosts'].items():
+                labels = dict(repo, host=host)
+                add('bili_transfer_bytes', 'CDN传输字节数', labels, entry['bytes'])
+                add('bili_transfer_seconds', 'CDN传输累计耗时', labels, entry['seconds'])
+                add('bili_transfer_requests', 'CDN请求数', labels, entry['requests'])
+            for key in ('downloaded', 'failed', 'deleted', 'total'):
+                if key in summary['totals']:
+                    add('bili_pull_videos', '上次同步的视频数量', dict(repo, result=key), summary['totals'][key])
+
+        lines = []
+        for name, (help_text, samples) in metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics(SyncMetrics):
+    """不记录任何内容，用于同步流程之外的调用"""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def api_request(self, endpoint, seconds, retry=False):
+        pass
+
+    def api_throttled(self, endpoint):
+        pass
+
+    def api_error(self, endpoint):
+        pass
+
+    def api_cache_hit(self, endpoint):
+        pass
+
+    def add_transfer(self, url, nbytes, seconds):
+        pass
+
+    def item_result(self, bvid, ok):
+        pass
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+
+NULL_METRICS = NullMetrics()
+
+
+def mb_per_sec(nbytes, seconds):
+    return round(nbytes / seconds / 1e6, 3) if seconds > 0 else None
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
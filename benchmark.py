@@ -0,0 +1,423 @@
+"""同步性能基准测试：在本地启动模拟的B站API和CDN，测量收藏夹列表、下载和完整同步的耗时
+
+用法:
+    python benchmark.py                                  # 默认 100 / 1000 / 10000 个视频
+    python benchmark.py --sizes 100,1000 --latency 0.05 --bandwidth 2000000 --output bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from ApiCache import NullCache
+from FavRepository import FavRepository
+from RateLimiter import RateLimiter
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端断开连接是正常情况（如取消下载、探测请求）
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockBilibiliServer:
+    """模拟B站API（收藏夹、视频信息、下载链接）和提供合成媒体文件的限速CDN"""
+
+    def __init__(self, item_count=100, latency=0.0, bandwidth=0, page_size=20, media_size=64 * 1024,
+                 api_error_rate=0.0, cdn_error_rate=0.0, seed=0, mirror_bandwidth=None):
+        self.item_count = item_count
+        # 每个请求的首字节延迟（秒）
+        self.latency = latency
+        # CDN每个连接的带宽（字节/秒），0为不限速
+        self.bandwidth = bandwidth
+        # 收藏夹列表每页最大数量，超过时与B站一样返回-400
+        self.page_size = page_size
+        self.media_size = media_size
+        # API返回风控(-412)的概率，CDN传输中途断开的概率
+        self.api_error_rate = api_error_rate
+        self.cdn_error_rate = cdn_error_rate
+
+        self.media = bytes(range(256)) * (media_size // 256) + bytes(media_size % 256)
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+        self.server = QuietHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        # 备用镜像：另一个端口上的CDN，作为下载链接的backupUrl返回，带宽单独设置
+        self.mirror_bandwidth = mirror_bandwidth
+        self.mirror_server = None
+        self.mirror_url = None
+        if mirror_bandwidth is not None:
+            self.mirror_server = QuietHTTPServer(('127.0.0.1', 0), self.make_handler(mirror=True))
+            self.mirror_url = f"http://127.0.0.1:{self.mirror_server.server_address[1]}"
+
+    def reset_stats(self):
+        with self._lock:
+            self.api_calls = {}
+            self.cdn_requests = 0
+            self.cdn_bytes = 0
+            self.mirror_bytes = 0
+            self.injected_errors = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'api_calls': dict(self.api_calls),
+                'cdn_requests': self.cdn_requests,
+                'cdn_bytes': self.cdn_bytes,
+                'mirror_bytes': self.mirror_bytes,
+                'injected_errors': self.injected_errors
+            }
+
+    def start(self):
+        for server in (self.server, self.mirror_server):
+            if server is not None:
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in (self.server, self.mirror_server):
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    def inject_error(self, rate):
+        with self._lock:
+            if rate and self.random.random() < rate:
+                self.injected_errors += 1
+                return True
+            return False
+
+    def make_media(self, index):
+        return {
+            'type': 2,
+            'bvid': f"BV{index:010d}",
+            'title': f"视频 {index}",
+            'upper': {'name': f"UP主 {index % 97}"},
+            'duration': 180 + index % 600,
+            'pubtime': 1600000000 + index,
+            'fav_time': 1700000000 - index,
+            'ugc': {'first_cid': 1000000 + index},
+            'page': 1
+        }
+
+    def api_response(self, path, query):
+        """返回接口的JSON数据，未知接口返回None"""
+        if path == '/x/v3/fav/folder/info':
+            return {'code': 0, 'data': {'id': int(query.get('media_id', 1)), 'title': 'benchmark',
+                                        'media_count': self.item_count, 'upper': {'name': 'benchmark'}}}
+
+        if path == '/x/v3/fav/resource/list':
+            pn = int(query.get('pn', 1))
+            ps = int(query.get('ps', 20))
+            if ps > self.page_size:
+                return {'code': -400, 'message': '请求错误'}
+            start = (pn - 1) * ps
+            end = min(start + ps, self.item_count)
+            medias = [self.make_media(i) for i in range(start, end)]
+            return {'code': 0, 'data': {'medias': medias or None, 'has_more': end < self.item_count}}
+
+        if path == '/x/web-interface/view':
+            index = int(query['bvid'][2:])
+            return {'code': 0, 'data': {'bvid': query['bvid'], 'pages': [{'cid': 1000000 + index, 'page': 1}]}}
+
+        if path == '/x/player/playurl':
+            bvid = query['bvid']
+            media_base = f"{self.base_url}/media/{bvid}"
+
+            def backup(name):
+                return [f"{self.mirror_url}/media/{bvid}/{name}"] if self.mirror_url else []
+
+            return {'code': 0, 'data': {'quality': int(query.get('qn', 80)), 'dash': {
+                'video': [{'baseUrl': f"{media_base}/video.m4s", 'backupUrl': backup('video.m4s')}],
+                'audio': [{'baseUrl': f"{media_base}/audio.m4s", 'backupUrl': backup('audio.m4s')}]
+            }}}
+
+        return None
+
+    def make_handler(self, mirror=False):
+        server = self
+        bandwidth = self.mirror_bandwidth if mirror else self.bandwidth
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if server.latency:
+                    time.sleep(server.latency)
+                if url.path.startswith('/media/'):
+                    self.serve_media()
+                else:
+                    self.serve_api(url)
+
+            def send_json(self, data):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def serve_api(self, url):
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                with server._lock:
+                    server.api_calls[url.path] = server.api_calls.get(url.path, 0) + 1
+
+                if server.inject_error(server.api_error_rate):
+                    return self.send_json({'code': -412, 'message': '请求被拦截'})
+
+                data = server.api_response(url.path, query)
+                if data is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_json(data)
+
+            def serve_media(self):
+                size = len(server.media)
+                start, end = 0, size - 1
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+
+                with server._lock:
+                    server.cdn_requests += 1
+                # 探测请求（bytes=0-0）不注入错误
+                cut = end - start > 0 and server.inject_error(server.cdn_error_rate)
+                stop = start + (end - start + 1) // 2 if cut else end + 1
+
+                chunk_size = 16 * 1024
+                position = start
+                try:
+                    while position < stop:
+                        chunk = server.media[position:min(position + chunk_size, stop)]
+                        self.wfile.write(chunk)
+                        position += len(chunk)
+                        with server._lock:
+                            server.cdn_bytes += len(chunk)
+                            if mirror:
+                                server.mirror_bytes += len(chunk)
+                        if bandwidth:
+                            time.sleep(len(chunk) / bandwidth)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+                    return
+
+                if cut:
+                    # 模拟传输中途断开
+                    self.close_connection = True
+                    self.wfile.flush()
+                    self.connection.shutdown(socket.SHUT_RDWR)
+
+        return Handler
+
+
+def make_repo(args, base_dir, server):
+    """创建指向模拟服务的同步引擎"""
+    limiter = RateLimiter(rate=args.api_rate, burst=max(1, int(args.api_rate)), max_rate=args.api_rate)
+    kwargs = {'cache': NullCache(), 'api_limiter': limiter, 'post_workers': args.post_workers}
+    if args.engine == 'async':
+        from AsyncFavRepository import AsyncFavRepository
+        repo = AsyncFavRepository(base_dir, transfer_concurrency=args.workers, **kwargs)
+    else:
+        repo = FavRepository(base_dir, max_transfers=args.max_transfers, **kwargs)
+    repo.set_api_base(server.base_url)
+    repo.fav_page_size = args.page_size
+    return repo
+
+
+def create_repo_config(repo, repo_name, fid, audio_only):
+    """直接写入仓库配置，不进行init的首次同步"""
+    repo.get_repo_path(repo_name).mkdir(exist_ok=True)
+    config = {
+        'repo_id': repo.get_next_repo_id(),
+        'fid': fid,
+        'repo_name': repo_name,
+        'fav_title': 'benchmark',
+        'fav_upper': 'benchmark',
+        'quality': 80,
+        'audio_only': audio_only,
+        'created_time': datetime.now().isoformat(),
+        'last_sync': None,
+        'video_list': {}
+    }
+    return repo.save_repo_config(repo_name, config)
+
+
+@contextlib.contextmanager
+def quiet(enabled):
+    """屏蔽同步过程中的输出"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_scenario(args, item_count):
+    """一个收藏夹规模下的完整测试，返回结果字典"""
+    server = MockBilibiliServer(item_count, args.latency, args.bandwidth, args.page_size, args.media_size,
+                                args.api_error_rate, args.cdn_error_rate, args.seed, args.mirror_bandwidth).start()
+    base_dir = tempfile.mkdtemp(prefix='bili_bench_')
+    result = {'items': item_count}
+    try:
+        repo = make_repo(args, base_dir, server)
+        pull_kwargs = {} if args.engine == 'async' else {'workers': args.workers}
+
+        # 收藏夹列表
+        with quiet(not args.verbose):
+            videos, seconds = timed(repo.get_favorite_videos, '1')
+        pages = server.stats()['api_calls'].get('/x/v3/fav/resource/list', 0)
+        result['listing'] = {
+            'seconds': round(seconds, 3),
+            'items': len(videos),
+            'pages': pages,
+            'pages_per_sec': round(pages / seconds, 2) if seconds else None
+        }
+
+        if args.skip_pull:
+            return result
+
+        # 首次完整同步
+        create_repo_config(repo, 'bench', '1', not args.video)
+        server.reset_stats()
+        stats = {}
+        with quiet(not args.verbose):
+            ok, seconds = timed(repo.pull_repo, 'bench', stats=stats, **pull_kwargs)
+        server_stats = server.stats()
+        api_calls = sum(server_stats['api_calls'].values())
+        result['pull'] = {
+            'ok': ok,
+            'seconds': round(seconds, 3),
+            'downloaded': stats.get('downloaded'),
+            'failed': stats.get('failed'),
+            'bytes': server_stats['cdn_bytes'],
+            'mirror_bytes': server_stats['mirror_bytes'],
+            'mb_per_sec': round(server_stats['cdn_bytes'] / seconds / 1e6, 2) if seconds else None,
+            'items_per_sec': round(item_count / seconds, 2) if seconds else None,
+            'api_calls': api_calls,
+            'api_calls_per_item': round(api_calls / item_count, 3) if item_count else None,
+            'api_calls_by_endpoint': server_stats['api_calls'],
+            'cdn_requests': server_stats['cdn_requests'],
+            'injected_errors': server_stats['injected_errors'],
+            'throttled': repo.api_limiter.throttled
+        }
+
+        # 同步过程自身记录的各阶段耗时
+        try:
+            with open(repo.get_repo_path('bench') / repo.METRICS_FILE, 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+            result['pull']['phases'] = summary['phases']
+            result['pull']['stages'] = summary['stages']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # 没有变化时的再次同步
+        server.reset_stats()
+        with quiet(not args.verbose):
+            _, seconds = timed(repo.pull_repo, 'bench', **pull_kwargs)
+        result['noop_pull'] = {
+            'seconds': round(seconds, 3),
+            'api_calls': sum(server.stats()['api_calls'].values())
+        }
+        return result
+    finally:
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+
+def print_result(result):
+    listing = result['listing']
+    print(f"[{result['items']} 个视频]")
+    print(f"  列表: {listing['pages']} 页, {listing['seconds']} 秒, {listing['pages_per_sec']} 页/秒")
+    if 'pull' in result:
+        pull = result['pull']
+        print(f"  同步: {pull['seconds']} 秒, 下载 {pull['downloaded']} 个, 失败 {pull['failed']} 个, "
+              f"{pull['mb_per_sec']} MB/s, 每个视频 {pull['api_calls_per_item']} 次API请求")
+        print(f"  无变化再同步: {result['noop_pull']['seconds']} 秒, {result['noop_pull']['api_calls']} 次API请求")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='B站收藏夹同步性能基准测试（本地模拟服务）')
+    parser.add_argument('--sizes', default='100,1000,10000', help='收藏夹视频数量，逗号分隔')
+    parser.add_argument('--engine', choices=['sync', 'async'], default='sync', help='同步引擎')
+    parser.add_argument('--workers', type=int, default=4, help='同时下载的视频数 (pull -j)，异步引擎为同时传输数')
+    parser.add_argument('--post-workers', type=int, default=2, help='合并线程数 (pull -m)')
+    parser.add_argument('--max-transfers', type=int, default=16, help='同时传输的文件数上限')
+    parser.add_argument('--api-rate', type=float, default=100.0, help='API限速器的速率（次/秒）')
+    parser.add_argument('--latency', type=float, default=0.005, help='每个请求的延迟（秒）')
+    parser.add_argument('--bandwidth', type=int, default=0, help='CDN每个连接的带宽（字节/秒），0为不限速')
+    parser.add_argument('--mirror-bandwidth', type=int, default=None,
+                        help='在下载链接中加入一个备用镜像，并设置其每个连接的带宽（字节/秒），0为不限速')
+    parser.add_argument('--page-size', type=int, default=20, help='收藏夹列表每页数量')
+    parser.add_argument('--media-size', type=int, default=64 * 1024, help='每个媒体文件的大小（字节）')
+    parser.add_argument('--api-error-rate', type=float, default=0.0, help='API返回风控的概率')
+    parser.add_argument('--cdn-error-rate', type=float, default=0.0, help='CDN传输中途断开的概率')
+    parser.add_argument('--video', action='store_true', help='下载视频模式（需要FFmpeg），默认仅音频')
+    parser.add_argument('--skip-pull', action='store_true', help='只测试收藏夹列表')
+    parser.add_argument('--seed', type=int, default=0, help='错误注入的随机种子')
+    parser.add_argument('--output', default='bench_results.json', help='结果JSON文件')
+    parser.add_argument('--keep', action='store_true', help='保留测试生成的仓库目录')
+    parser.add_argument('--verbose', action='store_true', help='显示同步过程的输出')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+
+    results = []
+    for size in sizes:
+        result = run_scenario(args, size)
+        print_result(result)
+        results.append(result)
+
+    report = {
+        'time': datetime.now().isoformat(),
+        'settings': vars(args),
+        'scenarios': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ B站收藏夹批量下载器 - Git风格仓库管理版
 
 import json
 import subprocess
+import sys
 from pathlib import Path
 
 from FavRepository import FavRepository
@@ -56,6 +57,182 @@ def get_base_dir():
             print(f"✗ 目录创建失败: {e}")
             print("请输入一个有效的目录路径")
 
+def parse_pull_args(args):
+    """解析pull命令参数:
+    pull [仓库ID或名称 ...] [--all] [-j 并发数] [-p 并行仓库数] [-t 最大传输数] [-m 合并线程数] [-i] [--resume] [-q] [--async] [--stream] [--prometheus 文件]
+
+    返回(仓库标识列表, pull_repo的关键字参数, 其他选项)
+    """
+    repo_inputs = []
+    options = {'incremental': False, 'resume': False}
+    flags = {'async': False, 'all': False, 'stream': False, 'quiet': False, 'parallel': 2, 'max_transfers': None,
+             'post_workers': None, 'prometheus': None}
+    value_args = {'-j': 'workers', '--workers': 'workers',
+                  '-p': 'parallel', '--parallel': 'parallel',
+                  '-t': 'max_transfers', '--max-transfers': 'max_transfers',
+                  '-m': 'post_workers', '--post-workers': 'post_workers'}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in value_args and i + 1 < len(args):
+            try:
+                value = max(1, int(args[i + 1]))
+                if value_args[arg] == 'workers':
+                    options['workers'] = value
+                else:
+                    flags[value_args[arg]] = value
+            except ValueError:
+                print(f"无效的数值: {arg} {args[i + 1]}")
+            i += 2
+            continue
+        if arg == '--prometheus' and i + 1 < len(args):
+            flags['prometheus'] = args[i + 1]
+            i += 2
+            continue
+        if arg in ('-i', '--incremental'):
+            options['incremental'] = True
+        elif arg == '--resume':
+            options['resume'] = True
+        elif arg == '--async':
+            flags['async'] = True
+        elif arg in ('-a', '--all'):
+            flags['all'] = True
+        elif arg == '--stream':
+            flags['stream'] = True
+        elif arg in ('-q', '--quiet'):
+            flags['quiet'] = True
+        else:
+            repo_inputs.append(arg)
+        i += 1
+    return repo_inputs, options, flags
+
+def create_async_repo(base_dir):
+    """创建异步引擎，缺少aiohttp时返回None"""
+    try:
+        from AsyncFavRepository import AsyncFavRepository
+    except ImportError:
+        print("异步引擎需要 aiohttp: pip install aiohttp")
+        return None
+    return AsyncFavRepository(base_dir)
+
+def pull_exit_code(results):
+    """根据同步结果计算退出码: 0全部成功, 1有视频下载失败或收藏夹列表获取不完整, 2有仓库同步失败或不存在"""
+    if any(not result.get('ok') for result in results.values()):
+        return 2
+    if any(result.get('failed') or result.get('incomplete') for result in results.values()):
+        return 1
+    return 0
+
+def run_pull(repo, base_dir, args, interactive=True):
+    """执行pull命令，返回退出码"""
+    repo_inputs, options, flags = parse_pull_args(args)
+
+    engine = create_async_repo(base_dir) if flags['async'] else repo
+    if not engine:
+        return 2
+
+    # 交互模式下同一个repo会执行多个命令，本次命令的选项在结束后恢复，不影响之后的命令
+    defaults = (engine.max_transfers, engine.post_workers, engine.stream_ffmpeg,
+                engine.progress.quiet, engine.prometheus_path)
+    try:
+        if flags['max_transfers']:
+            engine.set_max_transfers(flags['max_transfers'])
+        engine.stream_ffmpeg = flags['stream']
+        engine.progress.quiet = flags['quiet']
+        if flags['post_workers']:
+            engine.post_workers = flags['post_workers']
+        if flags['prometheus']:
+            engine.prometheus_path = flags['prometheus']
+        return pull_with_engine(repo, engine, repo_inputs, options, flags, interactive)
+    finally:
+        max_transfers, engine.post_workers, engine.stream_ffmpeg, engine.progress.quiet, engine.prometheus_path = defaults
+        if engine.max_transfers != max_transfers:
+            engine.set_max_transfers(max_transfers)
+
+def pull_with_engine(repo, engine, repo_inputs, options, flags, interactive):
+    """用设置好选项的引擎同步一个或多个仓库，返回退出码"""
+    # 多仓库同步
+    if flags['all'] or len(repo_inputs) > 1:
+        unresolved = []
+        repo_names = engine.resolve_repo_names(None if flags['all'] else repo_inputs, unresolved)
+        results = engine.pull_all(repo_names, flags['parallel'], **options) if repo_names else {}
+        # 找不到的仓库记为失败，其余仓库照常同步
+        for user_input in unresolved:
+            results[user_input] = {'ok': False, 'error': '仓库不存在'}
+        if unresolved:
+            print(f"✗ 未找到的仓库: {', '.join(unresolved)}")
+        return pull_exit_code(results) if results else 2
+
+    if not repo_inputs:
+        if not interactive:
+            print("请指定仓库ID或名称，或使用 --all")
+            return 2
+        repo.list_repos()
+        repo_inputs = [input("请输入仓库ID或名称: ").strip()]
+
+    repo_name = repo.parse_repo_input(repo_inputs[0])
+    if not repo_name:
+        return 2
+
+    stats = {}
+    ok = engine.pull_repo(repo_name, stats=stats, **options)
+    return pull_exit_code({repo_name: dict(stats, ok=ok)})
+
+def run_verify(repo, args, interactive=True):
+    """执行verify命令: verify [仓库ID或名称 ...] [--all] [--deep] [-n]
+
+    返回退出码: 0全部完好, 1发现缺失或损坏的文件, 2有仓库不存在
+    """
+    repo_inputs = [arg for arg in args if not arg.startswith('-')]
+    deep = '--deep' in args
+    repair = not ('-n' in args or '--dry-run' in args)
+
+    unresolved = []
+    if '--all' in args or '-a' in args:
+        repo_names = repo.resolve_repo_names()
+    else:
+        if not repo_inputs:
+            if not interactive:
+                print("请指定仓库ID或名称，或使用 --all")
+                return 2
+            repo.list_repos()
+            repo_inputs = [input("请输入仓库ID或名称: ").strip()]
+        repo_names = repo.resolve_repo_names(repo_inputs, unresolved)
+    if not repo_names:
+        return 2
+
+    code = 0
+    if unresolved:
+        print(f"✗ 未找到的仓库: {', '.join(unresolved)}")
+        code = 2
+    for repo_name in repo_names:
+        stats = repo.verify_repo(repo_name, deep=deep, repair=repair)
+        if stats is None:
+            code = 2
+        elif (stats['missing'] or stats['damaged']) and code == 0:
+            code = 1
+    return code
+
+def run_once(argv):
+    """非交互模式（用于cron等定时任务），支持pull和verify命令，返回退出码"""
+    command = argv[0].lower()
+    if command == 'fsck':
+        command = 'verify'
+    if command not in ('pull', 'verify'):
+        print(f"非交互模式不支持命令: {command}")
+        return 2
+
+    config_file = Path("bili_config.json")
+    if not config_file.exists():
+        print("尚未配置仓库目录，请先交互运行一次程序")
+        return 2
+    with open(config_file, 'r', encoding='utf-8') as f:
+        base_dir = json.load(f).get('base_dir', 'bili_repos')
+
+    if command == 'verify':
+        return run_verify(FavRepository(base_dir), argv[1:], interactive=False)
+    return run_pull(FavRepository(base_dir), base_dir, argv[1:], interactive=False)
+
 def main():
     print("bilibili Favlist Repository")
     print("=" * 50)
@@ -67,15 +244,20 @@ def main():
     print()
     print("命令说明:")
     print("  init   - 初始化新仓库")
-    print("  pull   - 同步指定仓库 (支持ID或名称)")
+    print("  pull   - 同步指定仓库 (支持ID或名称, 可加 -j N 并发下载, -i 增量同步, --resume 继续中断的同步, --async 异步引擎)")
+    print("           pull --all 或 pull 1 2 3 同时同步多个仓库 (-p N 并行仓库数, -t N 最大同时传输数)")
+    print("           -m N 合并线程数, --stream 边下载边合并，不写临时文件, -q 只定期输出进度汇总")
     print("  list   - 列出所有仓库")
     print("  config - 重新配置仓库目录")
     print("  update - 更新仓库属性 (清晰度/下载模式)")
+    print("  verify - 检查仓库文件是否完整，缺失或损坏的文件下次同步时重新下载 (--all, --deep 抽样哈希, -n 只检查)")
     print("  exit   - 退出程序")
     print()
     
     while True:
-        command = input("请输入命令: ").strip().lower()
+        parts = input("请输入命令: ").split()
+        command = parts[0].lower() if parts else ''
+        args = parts[1:]
         
         if command == 'exit':
             print("再见！")
@@ -108,12 +290,11 @@ def main():
         
         elif command == 'pull':
             print("\n=== 同步仓库 ===")
-            repo.list_repos()
-            user_input = input("请输入仓库ID或名称: ").strip()
-            
-            repo_name = repo.parse_repo_input(user_input)
-            if repo_name:
-                repo.pull_repo(repo_name)
+            run_pull(repo, base_dir, args)
+
+        elif command in ('verify', 'fsck'):
+            print("\n=== 检查仓库 ===")
+            run_verify(repo, args)
         
         elif command == 'update':
             print("\n=== 更新仓库属性 ===")
@@ -124,7 +305,7 @@ def main():
             if not repo_name:
                 continue
             
-            config = repo.load_repo_config(repo_name)
+            config = repo.load_repo_config(repo_name, with_videos=False)
             print(f"\n当前配置:")
             print(f"  仓库: [{config.get('repo_id', '未知')}] {repo_name}")
             print(f"  模式: {'仅音频' if config['audio_only'] else '视频'}")
@@ -179,7 +360,7 @@ def main():
             repo.list_repos()
         
         else:
-            print("未知命令，请输入 init、pull、list、config、update 或 exit")
+            print("未知命令，请输入 init、pull、list、config、update、verify 或 exit")
         
         print()
 
@@ -198,4 +379,8 @@ if __name__ == "__main__":
         print("请先安装 ffmpeg")
         exit(1)
     
+    # 带参数运行时执行单条命令后退出，例如: python main.py pull --all
+    if len(sys.argv) > 1:
+        sys.exit(run_once(sys.argv[1:]))
+    
     main()
\ No newline at end of file